@@ -1,17 +1,23 @@
 """Application implementation - ASGI."""
 
+import contextlib
+import gzip
+import hashlib
+import mimetypes
 import os
 
 from fastapi import FastAPI, Request
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from loguru import logger
 from fastapi.staticfiles import StaticFiles
-from fastapi.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from app.config import config
 from app.models.exception import HttpException
 from app.router import root_api_router
+from app.services import state as sm
 from app.utils import utils
 
 
@@ -29,10 +35,10 @@ def exception_handler(request: Request, e: HttpException):
         e (HttpException): The exception object containing details about the error.
 
     Returns:
-        JSONResponse: A JSON response with the status code and error message.
+        ORJSONResponse: A JSON response with the status code and error message.
     """
 
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=e.status_code,
         content=utils.get_response(e.status_code, e.data, e.message),
     )
@@ -55,12 +61,12 @@ def validation_exception_handler(request: Request, e: RequestValidationError):
             request validation, containing details about the errors.
 
     Returns:
-        JSONResponse: A JSON response with a status code of 400 and
+        ORJSONResponse: A JSON response with a status code of 400 and
             a message indicating that fields are required, along with
             the specific validation errors.
     """
 
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=400,
         content=utils.get_response(
             status=400, data=e.errors(), message="field required"
@@ -68,6 +74,52 @@ def validation_exception_handler(request: Request, e: RequestValidationError):
     )
 
 
+def prioritize_routes(instance: FastAPI, prefixes=("/api/v1/tasks",)):
+    """Move the routes under the hottest path prefixes to the front.
+
+    Starlette matches routes by walking the route list in order, so the
+    task polling endpoints are placed first. The sort is stable, so the
+    relative order of all other routes is kept. Which route wins for a
+    request only stays the same when no route ahead of a moved one can
+    match its path. That is checked first, and the order is left alone
+    when the check fails.
+    """
+    routes = instance.router.routes
+
+    def prioritized(route):
+        return getattr(route, "path", "").startswith(prefixes)
+
+    passed = []
+    for route in routes:
+        if not prioritized(route):
+            passed.append(route)
+            continue
+        # the path template stands in for every request path of the route,
+        # parameters like {task_id} are matched by the other route's patterns
+        for earlier in passed:
+            path_regex = getattr(earlier, "path_regex", None)
+            if path_regex is not None and path_regex.match(route.path):
+                logger.warning(
+                    f"not prioritizing routes, {earlier.path} may shadow {route.path}"
+                )
+                return
+
+    routes.sort(key=lambda route: 0 if prioritized(route) else 1)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(instance: FastAPI):
+    """Run the application's startup and shutdown work around its lifetime."""
+    logger.info("startup event")
+    mount_static_dirs(instance)
+    migrated = sm.state.migrate_legacy_tasks()
+    if migrated:
+        logger.info(f"migrated {migrated} tasks to the current state layout")
+    yield
+    logger.info("shutdown event")
+    await sm.state.aclose()
+
+
 def get_application() -> FastAPI:
     """Initialize a FastAPI application.
 
@@ -75,7 +127,7 @@ def get_application() -> FastAPI:
     application. It sets the title, description, and version of the
     application based on the provided configuration. Additionally, it
     includes a router for handling API requests and adds exception handlers
-    for specific exceptions.
+    for specific exceptions. Responses are serialized with orjson by default.
 
     Returns:
         FastAPI: An instance of the FastAPI application.
@@ -85,40 +137,279 @@ def get_application() -> FastAPI:
         description=config.project_description,
         version=config.project_version,
         debug=False,
+        default_response_class=ORJSONResponse,
+        lifespan=lifespan,
     )
     instance.include_router(root_api_router)
+    prioritize_routes(instance)
     instance.add_exception_handler(HttpException, exception_handler)
     instance.add_exception_handler(RequestValidationError, validation_exception_handler)
     return instance
 
 
+class SimpleCORSMiddleware:
+    """Pure ASGI CORS middleware.
+
+    Unlike a ``BaseHTTPMiddleware`` based implementation, this class never
+    builds Request/Response objects: it inspects the raw ASGI scope, answers
+    preflight requests directly and appends the CORS headers to the
+    ``http.response.start`` message of every other response.
+    """
+
+    ALLOW_METHODS = b"DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT"
+    PREFLIGHT_MAX_AGE = b"600"
+
+    def __init__(self, app: ASGIApp, allow_origins=("*",), allow_credentials=False):
+        self.app = app
+        self.allow_origins = frozenset(o.encode("latin-1") for o in allow_origins)
+        self.allow_all_origins = b"*" in self.allow_origins
+        self.allow_credentials = allow_credentials
+
+    def _allowed_origin(self, origin: bytes):
+        if self.allow_all_origins:
+            # "*" is not allowed together with credentials, echo the origin instead
+            return origin if self.allow_credentials else b"*"
+        if origin in self.allow_origins:
+            return origin
+        return None
+
+    def _cors_headers(self, allowed_origin: bytes):
+        headers = [(b"access-control-allow-origin", allowed_origin)]
+        if allowed_origin != b"*":
+            headers.append((b"vary", b"Origin"))
+        if self.allow_credentials:
+            headers.append((b"access-control-allow-credentials", b"true"))
+        return headers
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        origin = request_method = request_headers = None
+        for key, value in scope["headers"]:
+            if key == b"origin":
+                origin = value
+            elif key == b"access-control-request-method":
+                request_method = value
+            elif key == b"access-control-request-headers":
+                request_headers = value
+
+        if origin is None:
+            await self.app(scope, receive, send)
+            return
+
+        allowed_origin = self._allowed_origin(origin)
+        if scope["method"] == "OPTIONS" and request_method is not None:
+            await self._preflight(allowed_origin, request_headers, send)
+            return
+
+        if allowed_origin is None:
+            await self.app(scope, receive, send)
+            return
+
+        cors_headers = self._cors_headers(allowed_origin)
+
+        async def send_wrapper(message: Message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + cors_headers
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    async def _preflight(self, allowed_origin, request_headers, send: Send):
+        if allowed_origin is None:
+            status, body, headers = 400, b"Disallowed CORS origin", []
+        else:
+            status, body = 200, b"OK"
+            headers = self._cors_headers(allowed_origin)
+            headers.append((b"access-control-allow-methods", self.ALLOW_METHODS))
+            headers.append((b"access-control-max-age", self.PREFLIGHT_MAX_AGE))
+            if request_headers:
+                headers.append((b"access-control-allow-headers", request_headers))
+        headers.append((b"content-type", b"text/plain; charset=utf-8"))
+        headers.append((b"content-length", str(len(body)).encode("latin-1")))
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+
+class SelectiveGZipMiddleware:
+    """Gzip responses, except for paths that serve already-compressed media.
+
+    Task artifacts (mp4/mp3) and the video stream/download endpoints gain
+    nothing from gzip and must keep their Content-Length for range requests,
+    so they bypass the compressor entirely.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 500, exclude_prefixes=()):
+        self.app = app
+        self.gzip_app = GZipMiddleware(app, minimum_size=minimum_size)
+        self.exclude_prefixes = tuple(exclude_prefixes)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http" and not scope["path"].startswith(
+            self.exclude_prefixes
+        ):
+            await self.gzip_app(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+
+class CachingStaticFiles(StaticFiles):
+    """StaticFiles that lets browsers cache the served files.
+
+    Starlette already sends an ETag and Last-Modified with every file and
+    answers matching conditional requests with ``304 Not Modified``, so this
+    only adds a ``Cache-Control`` header to both kinds of responses.
+    """
+
+    def __init__(self, *args, max_age: int = 3600, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_control = f"public, max-age={max_age}"
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        response.headers["Cache-Control"] = self.cache_control
+        return response
+
+
+class StaticCacheMiddleware:
+    """Serve small files of the public directory straight from memory.
+
+    The cache maps a URL path to a pre-built response (body, optional gzip
+    body and headers), so hits on the SPA shell skip the filesystem and the
+    StaticFiles/FileResponse machinery entirely. Misses fall through to the
+    wrapped application.
+    """
+
+    def __init__(self, app: ASGIApp, cache: dict):
+        self.app = app
+        self.cache = cache
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        entry = None
+        if scope["type"] == "http" and scope["method"] in ("GET", "HEAD"):
+            entry = self.cache.get(scope["path"])
+        if entry is None:
+            await self.app(scope, receive, send)
+            return
+
+        body, gzip_body, headers, etag = entry
+        accept_gzip = False
+        for key, value in scope["headers"]:
+            if key == b"if-none-match":
+                if etag in value:
+                    await send(
+                        {"type": "http.response.start", "status": 304, "headers": headers}
+                    )
+                    await send({"type": "http.response.body", "body": b""})
+                    return
+            elif key == b"accept-encoding":
+                accept_gzip = b"gzip" in value
+
+        response_headers = list(headers)
+        if gzip_body is not None and accept_gzip:
+            body = gzip_body
+            response_headers.append((b"content-encoding", b"gzip"))
+        response_headers.append((b"content-length", str(len(body)).encode("latin-1")))
+        await send(
+            {"type": "http.response.start", "status": 200, "headers": response_headers}
+        )
+        if scope["method"] == "HEAD":
+            body = b""
+        await send({"type": "http.response.body", "body": body})
+
+
+def load_static_cache(directory: str, max_size: int = 2 * 1024 * 1024, max_age: int = 60):
+    """Load every file under `directory` not larger than `max_size` into memory.
+
+    Returns:
+        dict: URL path -> (body, gzip body or None, headers, etag). Directory
+            index files are also registered under the directory path.
+    """
+    cache = {}
+    for root, _, files in os.walk(directory):
+        for file in files:
+            file_path = os.path.join(root, file)
+            if os.path.getsize(file_path) > max_size:
+                continue
+            with open(file_path, "rb") as f:
+                body = f.read()
+
+            content_type = mimetypes.guess_type(file)[0] or "application/octet-stream"
+            compressible = content_type.startswith("text/") or content_type in (
+                "application/javascript",
+                "application/json",
+                "image/svg+xml",
+            )
+            if content_type.startswith("text/"):
+                content_type += "; charset=utf-8"
+            etag = f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'.encode()
+            headers = [
+                (b"content-type", content_type.encode("latin-1")),
+                (b"etag", etag),
+                (b"cache-control", f"public, max-age={max_age}".encode("latin-1")),
+            ]
+            gzip_body = None
+            if compressible and len(body) >= 500:
+                gzip_body = gzip.compress(body)
+                headers.append((b"vary", b"Accept-Encoding"))
+
+            entry = (body, gzip_body, headers, etag)
+            url_path = "/" + os.path.relpath(file_path, directory).replace(os.sep, "/")
+            cache[url_path] = entry
+            if file == "index.html":
+                cache[url_path[: -len(file)]] = entry
+    return cache
+
+
 app = get_application()
 
-# Configures the CORS middleware for the FastAPI app
-cors_allowed_origins_str = os.getenv("CORS_ALLOWED_ORIGINS", "")
-origins = cors_allowed_origins_str.split(",") if cors_allowed_origins_str else ["*"]
 app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    SelectiveGZipMiddleware,
+    minimum_size=500,
+    exclude_prefixes=("/tasks", "/api/v1/stream", "/api/v1/download"),
 )
 
-task_dir = utils.task_dir()
-app.mount(
-    "/tasks", StaticFiles(directory=task_dir, html=True, follow_symlink=True), name=""
+# Filled on startup, served before the StaticFiles fallback
+static_cache = {}
+app.add_middleware(StaticCacheMiddleware, cache=static_cache)
+
+# Configures the CORS middleware for the FastAPI app
+cors_allowed_origins_str = os.getenv("CORS_ALLOWED_ORIGINS", "").strip()
+origins = tuple(
+    o.strip() for o in cors_allowed_origins_str.split(",") if o.strip()
+) or ("*",)
+# "*" with credentials is invalid CORS, so the wildcard case answers a constant
+# "*" without credentials and skips the per-origin lookup altogether
+_allow_all_origins = origins == ("*",)
+app.add_middleware(
+    SimpleCORSMiddleware,
+    allow_origins=origins,
+    allow_credentials=not _allow_all_origins,
 )
 
-public_dir = utils.public_dir()
-app.mount("/", StaticFiles(directory=public_dir, html=True), name="")
 
+def mount_static_dirs(instance: FastAPI):
+    """Mount the task artifacts and the public web directory, once per app.
 
-@app.on_event("shutdown")
-def shutdown_event():
-    logger.info("shutdown event")
+    The directories are resolved here rather than at import time, so a worker
+    process does not touch the filesystem until it actually starts up.
+    """
+    if getattr(instance.state, "static_mounted", False):
+        return
 
+    task_dir = utils.task_dir()
+    instance.mount(
+        "/tasks",
+        CachingStaticFiles(directory=task_dir, html=True, follow_symlink=True),
+        name="",
+    )
 
-@app.on_event("startup")
-def startup_event():
-    logger.info("startup event")
+    public_dir = utils.public_dir()
+    instance.mount(
+        "/", CachingStaticFiles(directory=public_dir, html=True, max_age=60), name=""
+    )
+    static_cache.update(load_static_cache(public_dir))
+    logger.info(f"cached {len(static_cache)} static paths from: {public_dir}")
+    instance.state.static_mounted = True
@@ -14,8 +14,11 @@ FUNC_MAP = {
 
 
 class RedisTaskManager(TaskManager):
-    def __init__(self, max_concurrent_tasks: int, redis_url: str):
-        self.redis_client = redis.Redis.from_url(redis_url)
+    def __init__(self, max_concurrent_tasks: int, redis_url: str, connection_pool=None):
+        if connection_pool is not None:
+            self.redis_client = redis.Redis(connection_pool=connection_pool)
+        else:
+            self.redis_client = redis.Redis.from_url(redis_url)
         super().__init__(max_concurrent_tasks)
 
     def create_queue(self):
@@ -5,6 +5,7 @@ import shutil
 from typing import Union
 
 from fastapi import BackgroundTasks, Depends, Path, Request, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from fastapi.params import File
 from fastapi.responses import FileResponse, StreamingResponse
 from loguru import logger
@@ -45,7 +46,10 @@ redis_url = f"redis://:{_redis_password}@{_redis_host}:{_redis_port}/{_redis_db}
 # 根据配置选择合适的任务管理器
 if _enable_redis:
     task_manager = RedisTaskManager(
-        max_concurrent_tasks=_max_concurrent_tasks, redis_url=redis_url
+        max_concurrent_tasks=_max_concurrent_tasks,
+        redis_url=redis_url,
+        # share the state backend's connection pool when it is redis as well
+        connection_pool=getattr(sm.state, "connection_pool", None),
     )
 else:
     task_manager = InMemoryTaskManager(max_concurrent_tasks=_max_concurrent_tasks)
@@ -98,7 +102,7 @@ def create_task(
 @router.get(
     "/tasks/{task_id}", response_model=TaskQueryResponse, summary="Query task status"
 )
-def get_task(
+async def get_task(
     request: Request,
     task_id: str = Path(..., description="Task ID"),
     query: TaskQueryRequest = Depends(),
@@ -109,7 +113,7 @@ def get_task(
     endpoint = endpoint.rstrip("/")
 
     request_id = base.get_task_id(request)
-    task = sm.state.get_task(task_id)
+    task = await sm.state.aget_task(task_id)
     if task:
         task_dir = utils.task_dir()
 
@@ -145,16 +149,19 @@ def get_task(
     response_model=TaskDeletionResponse,
     summary="Delete a generated short video task",
 )
-def delete_video(request: Request, task_id: str = Path(..., description="Task ID")):
+async def delete_video(
+    request: Request, task_id: str = Path(..., description="Task ID")
+):
     request_id = base.get_task_id(request)
-    task = sm.state.get_task(task_id)
+    task = await sm.state.aget_task(task_id)
     if task:
         tasks_dir = utils.task_dir()
         current_task_dir = os.path.join(tasks_dir, task_id)
         if os.path.exists(current_task_dir):
-            shutil.rmtree(current_task_dir)
+            # removing the videos is blocking disk work, keep it off the event loop
+            await run_in_threadpool(shutil.rmtree, current_task_dir)
 
-        sm.state.delete_task(task_id)
+        await sm.state.adelete_task(task_id)
         logger.success(f"video deleted: {utils.to_json(task)}")
         return utils.get_response(200)
 
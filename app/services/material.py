@@ -1,7 +1,10 @@
+import asyncio
 import os
 import random
+import threading
 from urllib.parse import urlencode
 
+import aiohttp
 import requests
 from typing import List
 from loguru import logger
@@ -12,6 +15,8 @@ from app.models.schema import VideoAspect, VideoConcatMode, MaterialInfo
 from app.utils import utils
 
 requested_count = 0
+# maximum number of videos downloaded at the same time
+_download_concurrency = int(config.app.get("material_download_concurrency", 8))
 
 
 def get_api_key(cfg_key: str):
@@ -142,16 +147,7 @@ def search_videos_pixabay(
 
 
 def save_video(video_url: str, save_dir: str = "") -> str:
-    if not save_dir:
-        save_dir = utils.storage_dir("cache_videos")
-
-    if not os.path.exists(save_dir):
-        os.makedirs(save_dir)
-
-    url_without_query = video_url.split("?")[0]
-    url_hash = utils.md5(url_without_query)
-    video_id = f"vid-{url_hash}"
-    video_path = f"{save_dir}/{video_id}.mp4"
+    video_path = _video_path(video_url, save_dir)
 
     # if video already exists, return the path
     if os.path.exists(video_path) and os.path.getsize(video_path) > 0:
@@ -166,6 +162,23 @@ def save_video(video_url: str, save_dir: str = "") -> str:
             ).content
         )
 
+    return _validate_video(video_path)
+
+
+def _video_path(video_url: str, save_dir: str = "") -> str:
+    if not save_dir:
+        save_dir = utils.storage_dir("cache_videos")
+
+    if not os.path.exists(save_dir):
+        os.makedirs(save_dir, exist_ok=True)
+
+    url_without_query = video_url.split("?")[0]
+    url_hash = utils.md5(url_without_query)
+    video_id = f"vid-{url_hash}"
+    return f"{save_dir}/{video_id}.mp4"
+
+
+def _validate_video(video_path: str) -> str:
     if os.path.exists(video_path) and os.path.getsize(video_path) > 0:
         try:
             clip = VideoFileClip(video_path)
@@ -183,6 +196,60 @@ def save_video(video_url: str, save_dir: str = "") -> str:
     return ""
 
 
+async def _save_videos(
+    video_urls: List[str], save_dir: str, cancel_event: threading.Event = None
+) -> List[str]:
+    """
+    download the videos concurrently over one session, returns the saved path
+    of every url in order, "" for the ones that failed
+    """
+    connector = aiohttp.TCPConnector(limit=_download_concurrency, ssl=False)
+    timeout = aiohttp.ClientTimeout(sock_connect=60, sock_read=240)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        return await asyncio.gather(
+            *(
+                _save_video_async(session, video_url, save_dir, cancel_event)
+                for video_url in video_urls
+            )
+        )
+
+
+async def _save_video_async(
+    session, video_url: str, save_dir: str, cancel_event: threading.Event = None
+) -> str:
+    video_path = _video_path(video_url, save_dir)
+    if os.path.exists(video_path) and os.path.getsize(video_path) > 0:
+        logger.info(f"video already exists: {video_path}")
+        return video_path
+
+    logger.info(f"downloading video: {video_url}")
+    # written next to the target and renamed once complete, an interrupted
+    # download never leaves a truncated mp4 in the cache
+    part_path = f"{video_path}.part"
+    proxy = config.proxy.get("https") or config.proxy.get("http") or None
+    completed = False
+    try:
+        async with session.get(video_url, proxy=proxy) as r:
+            r.raise_for_status()
+            with open(part_path, "wb") as f:
+                async for chunk in r.content.iter_chunked(64 * 1024):
+                    if cancel_event is not None and cancel_event.is_set():
+                        break
+                    f.write(chunk)
+                else:
+                    completed = True
+        if completed:
+            os.replace(part_path, video_path)
+    except Exception as e:
+        logger.error(f"failed to download video: {video_url} => {str(e)}")
+    if not completed:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        return ""
+
+    return await asyncio.to_thread(_validate_video, video_path)
+
+
 def download_videos(
     task_id: str,
     search_terms: List[str],
@@ -191,7 +258,14 @@ def download_videos(
     video_contact_mode: VideoConcatMode = VideoConcatMode.random,
     audio_duration: float = 0.0,
     max_clip_duration: int = 5,
+    cancel_event: threading.Event = None,
+    remaining_items: List[MaterialInfo] = None,
 ) -> List[str]:
+    """
+    search the terms and download enough clips to cover audio_duration.
+    the search results that were not downloaded are appended to
+    remaining_items when given, see download_more_videos
+    """
     valid_video_items = []
     valid_video_urls = []
     found_duration = 0.0
@@ -200,6 +274,9 @@ def download_videos(
         search_videos = search_videos_pixabay
 
     for search_term in search_terms:
+        if cancel_event is not None and cancel_event.is_set():
+            logger.info("download cancelled")
+            return []
         video_items = search_videos(
             search_term=search_term,
             minimum_duration=max_clip_duration,
@@ -216,40 +293,103 @@ def download_videos(
     logger.info(
         f"found total videos: {len(valid_video_items)}, required duration: {audio_duration} seconds, found duration: {found_duration} seconds"
     )
-    video_paths = []
 
+    material_directory = _material_directory(task_id)
+    if video_contact_mode.value == VideoConcatMode.random.value:
+        random.shuffle(valid_video_items)
+    else:
+        # clips already on disk from earlier tasks go first, they cost nothing
+        valid_video_items.sort(
+            key=lambda item: not os.path.isfile(
+                _video_path(item.url, material_directory)
+            )
+        )
+
+    video_paths = _download_items(
+        valid_video_items,
+        material_directory,
+        audio_duration,
+        max_clip_duration,
+        cancel_event,
+    )
+    if remaining_items is not None:
+        remaining_items.extend(valid_video_items)
+    return video_paths
+
+
+def download_more_videos(
+    task_id: str,
+    video_items: List[MaterialInfo],
+    audio_duration: float,
+    max_clip_duration: int = 5,
+    cancel_event: threading.Event = None,
+) -> List[str]:
+    """
+    download further clips covering audio_duration from the search results
+    an earlier download_videos left in video_items, without searching again.
+    the clips used are removed from video_items
+    """
+    if not video_items:
+        logger.warning("no search results left to download more videos from")
+        return []
+    return _download_items(
+        video_items,
+        _material_directory(task_id),
+        audio_duration,
+        max_clip_duration,
+        cancel_event,
+    )
+
+
+def _material_directory(task_id: str) -> str:
     material_directory = config.app.get("material_directory", "").strip()
     if material_directory == "task":
         material_directory = utils.task_dir(task_id)
     elif material_directory and not os.path.isdir(material_directory):
         material_directory = ""
+    return material_directory
 
-    if video_contact_mode.value == VideoConcatMode.random.value:
-        random.shuffle(valid_video_items)
 
+def _download_items(
+    pending: List[MaterialInfo],
+    material_directory: str,
+    audio_duration: float,
+    max_clip_duration: int,
+    cancel_event: threading.Event = None,
+) -> List[str]:
+    # download just enough clips to cover the audio in one concurrent batch,
+    # and top up with further batches if some of the downloads failed. the
+    # items are taken from the front of pending
+    video_paths = []
     total_duration = 0.0
-    for item in valid_video_items:
-        try:
-            logger.info(f"downloading video: {item.url}")
-            saved_video_path = save_video(
-                video_url=item.url, save_dir=material_directory
-            )
+    while pending and total_duration <= audio_duration:
+        if cancel_event is not None and cancel_event.is_set():
+            logger.info("download cancelled")
+            return []
+
+        batch = []
+        batch_duration = total_duration
+        while pending and batch_duration <= audio_duration:
+            item = pending.pop(0)
+            batch.append(item)
+            batch_duration += min(max_clip_duration, item.duration)
+
+        saved_video_paths = asyncio.run(
+            _save_videos([item.url for item in batch], material_directory, cancel_event)
+        )
+        for item, saved_video_path in zip(batch, saved_video_paths):
             if saved_video_path:
                 logger.info(f"video saved: {saved_video_path}")
                 video_paths.append(saved_video_path)
-                seconds = min(max_clip_duration, item.duration)
-                total_duration += seconds
-                if total_duration > audio_duration:
-                    logger.info(
-                        f"total duration of downloaded videos: {total_duration} seconds, skip downloading more"
-                    )
-                    break
-        except Exception as e:
-            logger.error(f"failed to download video: {utils.to_json(item)} => {str(e)}")
+                total_duration += min(max_clip_duration, item.duration)
+
+    if cancel_event is not None and cancel_event.is_set():
+        logger.info("download cancelled")
+        return []
+    logger.info(f"total duration of downloaded videos: {total_duration} seconds")
     logger.success(f"downloaded {len(video_paths)} videos")
     return video_paths
 
-
 if __name__ == "__main__":
     download_videos(
         "test123", ["Money Exchange Medium"], audio_duration=100, source="pixabay"
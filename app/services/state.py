@@ -1,9 +1,27 @@
 import ast
+import asyncio
+import threading
 from abc import ABC, abstractmethod
+from array import array
+
+import msgpack
+
 from app.config import config
 from app.models import const
 
 
+# bounds the redis requests in flight from the event loop (the async task
+# routes), so bursts of concurrent requests queue here instead of piling up
+# on the connection pool
+_redis_sem = asyncio.Semaphore(int(config.app.get("redis_max_inflight", 64)))
+
+
+def _clamp_progress(progress, _int=int, _min=min, _max=max) -> int:
+    # shared by every backend on each update; builtins are bound as defaults
+    # so the call does not pay for global lookups
+    return _max(_min(_int(progress), 100), 0)
+
+
 # Base class for state management
 class BaseState(ABC):
     @abstractmethod
@@ -14,11 +32,57 @@ class BaseState(ABC):
     def get_task(self, task_id: str):
         pass
 
+    def get_tasks(self, task_ids: list) -> dict:
+        """Retrieve several tasks at once, mapping each task ID to its task or None.
+
+        The API only queries single tasks so far, this is the batch read a
+        task listing or a client polling several tasks should go through.
+        """
+        return {task_id: self.get_task(task_id) for task_id in task_ids}
+
+    # Coroutine variants for use from the event loop. Backends without I/O
+    # can rely on these defaults, network backends override them.
+    async def aupdate_task(
+        self,
+        task_id: str,
+        state: int = const.TASK_STATE_PROCESSING,
+        progress: int = 0,
+        **kwargs,
+    ):
+        self.update_task(task_id, state=state, progress=progress, **kwargs)
+
+    async def aget_task(self, task_id: str):
+        return self.get_task(task_id)
+
+    async def adelete_task(self, task_id: str):
+        self.delete_task(task_id)
+
+    def migrate_legacy_tasks(self) -> int:
+        """Convert the records of older storage layouts, once at startup.
+
+        Returns:
+            int: The number of tasks migrated.
+        """
+        return 0
+
+    async def aclose(self):
+        pass
+
 
 # Memory state management
 class MemoryState(BaseState):
     def __init__(self):
-        self._tasks = {}
+        # struct-of-arrays layout: every task owns one slot in the state and
+        # progress columns, extra fields only exist for tasks that have any.
+        # Slots of deleted tasks are not reused, which keeps lock-free readers
+        # from ever seeing another task's values.
+        self._index = {}
+        self._state = array("i")
+        self._progress = array("B")
+        self._extras = {}
+        # sync route handlers and task workers run in different threads; only
+        # writers take the lock, readers rely on atomic dict/array lookups
+        self._lock = threading.Lock()
 
     def update_task(
         self,
@@ -32,7 +96,8 @@ class MemoryState(BaseState):
         This function updates the specified task's state and progress in the
         internal task management system. It ensures that the progress value does
         not exceed 100. Additional keyword arguments can be provided to update
-        other attributes of the task.
+        other attributes of the task; they are merged into the fields already
+        stored for the task, like the redis backend does.
 
         Args:
             task_id (str): The unique identifier of the task to be updated.
@@ -40,18 +105,35 @@ class MemoryState(BaseState):
             progress (int?): The progress percentage of the task. Defaults to 0.
         """
 
-        progress = int(progress)
-        if progress > 100:
-            progress = 100
-
-        self._tasks[task_id] = {
-            "state": state,
-            "progress": progress,
-            **kwargs,
-        }
+        progress = _clamp_progress(progress)
+
+        with self._lock:
+            i = self._index.get(task_id)
+            if i is None:
+                i = len(self._state)
+                self._state.append(0)
+                self._progress.append(0)
+                self._index[task_id] = i
+
+            self._state[i] = state
+            self._progress[i] = progress
+            if kwargs:
+                extras = self._extras.get(task_id)
+                if extras is None:
+                    self._extras[task_id] = kwargs
+                else:
+                    extras.update(kwargs)
 
     def get_task(self, task_id: str):
-        return self._tasks.get(task_id, None)
+        i = self._index.get(task_id)
+        if i is None:
+            return None
+
+        return {
+            "state": self._state[i],
+            "progress": self._progress[i],
+            **self._extras.get(task_id, {}),
+        }
 
     def delete_task(self, task_id: str):
         """Delete a task from the task list.
@@ -64,16 +146,69 @@ class MemoryState(BaseState):
             task_id (str): The unique identifier of the task to be deleted.
         """
 
-        if task_id in self._tasks:
-            del self._tasks[task_id]
+        with self._lock:
+            if self._index.pop(task_id, None) is not None:
+                self._extras.pop(task_id, None)
 
 
 # Redis state management
 class RedisState(BaseState):
-    def __init__(self, host="localhost", port=6379, db=0, password=None):
+    # every task is a hash under this key prefix, each field msgpack encoded
+    KEY_PREFIX = "task:"
+    # tasks of the old layout are hashes under the bare uuid task id
+    LEGACY_KEY_PATTERN = "????????-????-????-????-????????????"
+    # read-through cache collapsing bursts of progress polling into one read
+    # per task and interval; writes and deletes through this instance evict
+    CACHE_MAX_SIZE = 512
+    CACHE_TTL = 0.2
+
+    def __init__(
+        self,
+        host="localhost",
+        port=6379,
+        db=0,
+        password=None,
+        ttl=0,
+        max_connections=32,
+    ):
         import redis
-
-        self._redis = redis.StrictRedis(host=host, port=port, db=db, password=password)
+        from cachetools import TTLCache
+
+        self._connection_kwargs = dict(
+            host=host,
+            port=port,
+            db=db,
+            password=password,
+            max_connections=max_connections,
+            timeout=5,
+            socket_keepalive=True,
+        )
+        # bounded pool: bursts wait for a free connection instead of opening
+        # new sockets, and other redis users in the process can share it.
+        # Responses stay raw bytes (no decode_responses), msgpack decodes the
+        # field values, and the hiredis parser is picked up
+        # automatically when installed.
+        self._pool = redis.BlockingConnectionPool(**self._connection_kwargs)
+        self._redis = redis.StrictRedis(connection_pool=self._pool)
+        # asyncio client for the event loop, created on first use
+        self._async_redis = None
+        # expire task records after `ttl` seconds, 0 keeps them forever
+        self._ttl = ttl or None
+        self._cache = TTLCache(maxsize=self.CACHE_MAX_SIZE, ttl=self.CACHE_TTL)
+        self._cache_lock = threading.Lock()
+
+    @property
+    def connection_pool(self):
+        return self._pool
+
+    @property
+    def async_redis(self):
+        if self._async_redis is None:
+            import redis.asyncio as aioredis
+
+            pool = aioredis.BlockingConnectionPool(**self._connection_kwargs)
+            self._async_redis = aioredis.StrictRedis(connection_pool=pool)
+        return self._async_redis
 
     def update_task(
         self,
@@ -84,10 +219,12 @@ class RedisState(BaseState):
     ):
         """Update the state and progress of a task in the Redis database.
 
-        This function updates the specified task's state and progress in the
-        Redis database. It ensures that the progress value does not exceed 100
-        and allows for additional fields to be updated through keyword
-        arguments.
+        This function stores the specified task's state, progress and any
+        additional fields as msgpack encoded fields of the task's hash. The
+        fields are merged into the ones already stored by redis itself, like
+        the memory backend does, so an update is a single HSET, sent together
+        with the EXPIRE in one round trip when records expire. It ensures that
+        the progress value does not exceed 100.
 
         Args:
             task_id (str): The unique identifier of the task to be updated.
@@ -95,30 +232,48 @@ class RedisState(BaseState):
                 const.TASK_STATE_PROCESSING.
             progress (int?): The current progress of the task,
                 represented as a percentage. Defaults to 0.
-            **kwargs: Additional fields to update in the task.
+            **kwargs: Additional fields to store with the task.
         """
 
-        progress = int(progress)
-        if progress > 100:
-            progress = 100
-
-        fields = {
-            "state": state,
-            "progress": progress,
-            **kwargs,
-        }
-
-        for field, value in fields.items():
-            self._redis.hset(task_id, field, str(value))
+        key = self._key(task_id)
+        task = {**kwargs, "state": state, "progress": _clamp_progress(progress)}
+        fields = self._pack(task)
+        if self._ttl is None:
+            self._redis.hset(key, mapping=fields)
+        else:
+            with self._redis.pipeline() as pipe:
+                pipe.hset(key, mapping=fields)
+                pipe.expire(key, self._ttl)
+                pipe.execute()
+        self._evict(task_id)
+
+    async def aupdate_task(
+        self,
+        task_id: str,
+        state: int = const.TASK_STATE_PROCESSING,
+        progress: int = 0,
+        **kwargs,
+    ):
+        key = self._key(task_id)
+        task = {**kwargs, "state": state, "progress": _clamp_progress(progress)}
+        fields = self._pack(task)
+        async with _redis_sem:
+            if self._ttl is None:
+                await self.async_redis.hset(key, mapping=fields)
+            else:
+                async with self.async_redis.pipeline() as pipe:
+                    pipe.hset(key, mapping=fields)
+                    pipe.expire(key, self._ttl)
+                    await pipe.execute()
+        self._evict(task_id)
 
     def get_task(self, task_id: str):
         """Retrieve a task from the Redis database using its task ID.
 
-        This function fetches the task data associated with the given task ID
-        from a Redis database. If the task data is found, it decodes the keys
-        from bytes to strings and converts the values to their original types
-        before returning the task as a dictionary. If no task data is found, it
-        returns None.
+        This function fetches the hash stored under the given task ID and
+        unpacks its msgpack encoded fields into a dictionary. Recently read
+        tasks are served from a short-lived local cache. If no task data is
+        found, it returns None.
 
         Args:
             task_id (str): The unique identifier for the task to be retrieved.
@@ -128,48 +283,127 @@ class RedisState(BaseState):
             or None if no task data exists for the given task ID.
         """
 
-        task_data = self._redis.hgetall(task_id)
-        if not task_data:
-            return None
+        task = self._cached(task_id)
+        if task is None:
+            task = self._unpack(self._redis.hgetall(self._key(task_id)))
+            task = self._remember(task_id, task)
+        return task
 
-        task = {
-            key.decode("utf-8"): self._convert_to_original_type(value)
-            for key, value in task_data.items()
-        }
+    async def aget_task(self, task_id: str):
+        task = self._cached(task_id)
+        if task is None:
+            async with _redis_sem:
+                fields = await self.async_redis.hgetall(self._key(task_id))
+            task = self._remember(task_id, self._unpack(fields))
         return task
 
+    def get_tasks(self, task_ids: list) -> dict:
+        # one pipelined round trip for all tasks
+        if not task_ids:
+            return {}
+        with self._redis.pipeline(transaction=False) as pipe:
+            for task_id in task_ids:
+                pipe.hgetall(self._key(task_id))
+            results = pipe.execute()
+        return {
+            task_id: self._unpack(fields) for task_id, fields in zip(task_ids, results)
+        }
+
+    def migrate_legacy_tasks(self) -> int:
+        """Move the tasks of the old layout under the key prefix.
+
+        Before the msgpack layout every task was a hash under its bare task
+        ID with str() values. They are converted in one pass at startup, so
+        the reads and writes never have to look at the old keys. A task that
+        already has a record in the new layout keeps it.
+
+        Returns:
+            int: The number of tasks migrated.
+        """
+
+        migrated = 0
+        for name in self._redis.scan_iter(match=self.LEGACY_KEY_PATTERN, _type="HASH"):
+            task_id = name.decode("utf-8")
+            key = self._key(task_id)
+            task = self._unpack_legacy(self._redis.hgetall(name))
+            with self._redis.pipeline() as pipe:
+                if task and not self._redis.exists(key):
+                    pipe.hset(key, mapping=self._pack(task))
+                    if self._ttl is not None:
+                        pipe.expire(key, self._ttl)
+                    migrated += 1
+                pipe.delete(name)
+                pipe.execute()
+        return migrated
+
     def delete_task(self, task_id: str):
-        self._redis.delete(task_id)
+        self._redis.delete(self._key(task_id))
+        self._evict(task_id)
+
+    async def adelete_task(self, task_id: str):
+        async with _redis_sem:
+            await self.async_redis.delete(self._key(task_id))
+        self._evict(task_id)
+
+    async def aclose(self):
+        if self._async_redis is not None:
+            await self._async_redis.aclose()
+            await self._async_redis.connection_pool.disconnect()
+            self._async_redis = None
+
+    def _cached(self, task_id: str):
+        with self._cache_lock:
+            task = self._cache.get(task_id)
+        # callers may modify the returned dict, never hand out the cached one
+        return dict(task) if task is not None else None
+
+    def _remember(self, task_id: str, task):
+        if task is not None:
+            with self._cache_lock:
+                self._cache[task_id] = task
+            task = dict(task)
+        return task
+
+    def _evict(self, task_id: str):
+        with self._cache_lock:
+            self._cache.pop(task_id, None)
+
+    @classmethod
+    def _key(cls, task_id: str) -> str:
+        return f"{cls.KEY_PREFIX}{task_id}"
 
     @staticmethod
-    def _convert_to_original_type(value):
-        """Convert the value from byte string to its original data type.
+    def _pack(task: dict) -> dict:
+        return {
+            name: msgpack.packb(value, use_bin_type=True) for name, value in task.items()
+        }
 
-        This function attempts to decode a byte string into its original
-        representation. It first decodes the byte string to a UTF-8 string and
-        then tries to evaluate it as a Python literal. If the evaluation fails,
-        it checks if the string represents an integer and converts it
-        accordingly. Additional data type conversions can be added as needed.
+    @staticmethod
+    def _unpack(fields: dict):
+        if not fields:
+            return None
+        return {
+            name.decode("utf-8"): msgpack.unpackb(value, raw=False)
+            for name, value in fields.items()
+        }
 
-        Args:
-            value (bytes): The byte string to be converted.
+    @classmethod
+    def _unpack_legacy(cls, fields: dict):
+        # every value of the old layout is stored as str()
+        if not fields:
+            return None
+        return {
+            key.decode("utf-8"): cls._convert_to_original_type(value)
+            for key, value in fields.items()
+        }
 
-        Returns:
-            The original data type of the input value, which could be a list,
-            integer, or string.
-        """
+    @staticmethod
+    def _convert_to_original_type(value):
         value_str = value.decode("utf-8")
-
         try:
-            # try to convert byte string array to list
             return ast.literal_eval(value_str)
         except (ValueError, SyntaxError):
-            pass
-
-        if value_str.isdigit():
-            return int(value_str)
-        # Add more conversions here if needed
-        return value_str
+            return value_str
 
 
 # Global state
@@ -178,10 +412,17 @@ _redis_host = config.app.get("redis_host", "localhost")
 _redis_port = config.app.get("redis_port", 6379)
 _redis_db = config.app.get("redis_db", 0)
 _redis_password = config.app.get("redis_password", None)
+_redis_task_ttl = config.app.get("redis_task_ttl", 0)
+_redis_max_connections = int(config.app.get("redis_max_connections", 32))
 
 state = (
     RedisState(
-        host=_redis_host, port=_redis_port, db=_redis_db, password=_redis_password
+        host=_redis_host,
+        port=_redis_port,
+        db=_redis_db,
+        password=_redis_password,
+        ttl=_redis_task_ttl,
+        max_connections=_redis_max_connections,
     )
     if _enable_redis
     else MemoryState()
@@ -14,8 +14,15 @@ device = config.whisper.get("device", "cpu")
 compute_type = config.whisper.get("compute_type", "int8")
 model = None
 
+# how many script lines or cues may be joined to align a single cue
+_ALIGN_WINDOW = 4
+
 
 def create(audio_file, subtitle_file: str = ""):
+    """
+    transcribe the audio into subtitle_file, returns the file path and the
+    subtitle items in the file_to_subtitles format, (None, []) on failure
+    """
     global model
     if not model:
         model_path = f"{utils.root_dir()}/models/whisper-{model_size}"
@@ -39,7 +46,7 @@ def create(audio_file, subtitle_file: str = ""):
                 f"see [README.md FAQ](https://github.com/harry0703/MoneyPrinterTurbo) for more details.\n"
                 f"********************************************\n\n"
             )
-            return None
+            return None, []
 
     logger.info(f"start, output file: {subtitle_file}")
     if not subtitle_file:
@@ -120,12 +127,19 @@ def create(audio_file, subtitle_file: str = ""):
 
     idx = 1
     lines = []
+    items = []
     for subtitle in subtitles:
         text = subtitle.get("msg")
         if text:
-            lines.append(
-                utils.text_to_srt(
-                    idx, text, subtitle.get("start_time"), subtitle.get("end_time")
+            start_time = subtitle.get("start_time")
+            end_time = subtitle.get("end_time")
+            lines.append(utils.text_to_srt(idx, text, start_time, end_time))
+            items.append(
+                (
+                    idx,
+                    f"{utils.time_convert_seconds_to_hmsm(start_time)} --> "
+                    f"{utils.time_convert_seconds_to_hmsm(end_time)}",
+                    text,
                 )
             )
             idx += 1
@@ -134,27 +148,36 @@ def create(audio_file, subtitle_file: str = ""):
     with open(subtitle_file, "w", encoding="utf-8") as f:
         f.write(sub)
     logger.info(f"subtitle file created: {subtitle_file}")
+    return subtitle_file, items
+
 
+def file_to_subtitles(filename, from_text=None):
+    # from_text: srt content already in memory, skips reading the file
+    if from_text is not None:
+        return _parse_subtitles(from_text.splitlines(keepends=True))
 
-def file_to_subtitles(filename):
     if not filename or not os.path.isfile(filename):
         return []
 
+    with open(filename, "r", encoding="utf-8") as f:
+        return _parse_subtitles(f)
+
+
+def _parse_subtitles(lines):
     times_texts = []
     current_times = None
     current_text = ""
     index = 0
-    with open(filename, "r", encoding="utf-8") as f:
-        for line in f:
-            times = re.findall("([0-9]*:[0-9]*:[0-9]*,[0-9]*)", line)
-            if times:
-                current_times = line
-            elif line.strip() == "" and current_times:
-                index += 1
-                times_texts.append((index, current_times.strip(), current_text.strip()))
-                current_times, current_text = None, ""
-            elif current_times:
-                current_text += line
+    for line in lines:
+        times = re.findall("([0-9]*:[0-9]*:[0-9]*,[0-9]*)", line)
+        if times:
+            current_times = line
+        elif line.strip() == "" and current_times:
+            index += 1
+            times_texts.append((index, current_times.strip(), current_text.strip()))
+            current_times, current_text = None, ""
+        elif current_times:
+            current_text += line
     return times_texts
 
 
@@ -184,8 +207,11 @@ def similarity(a, b):
     return 1 - (distance / max_length)
 
 
-def correct(subtitle_file, video_script):
-    subtitle_items = file_to_subtitles(subtitle_file)
+def correct(subtitle_file, video_script, subtitle_items=None):
+    # subtitle_items: the parsed content of subtitle_file when the caller has it,
+    # returns the items of the corrected file
+    if subtitle_items is None:
+        subtitle_items = file_to_subtitles(subtitle_file)
     script_lines = utils.split_string_by_punctuations(video_script)
 
     corrected = False
@@ -203,22 +229,47 @@ def correct(subtitle_file, video_script):
             subtitle_index += 1
         else:
             combined_subtitle = subtitle_line
-            start_time = subtitle_items[subtitle_index][1].split(" --> ")[0]
-            end_time = subtitle_items[subtitle_index][1].split(" --> ")[1]
+            times = subtitle_items[subtitle_index][1].split(" --> ")
+            start_time, end_time = times[0], times[1]
             next_subtitle_index = subtitle_index + 1
 
-            while next_subtitle_index < len(subtitle_items):
+            # the score of the merged text so far is carried forward, every
+            # candidate costs a single levenshtein pass. whisper may fold
+            # several script lines into one cue or split one line over
+            # several cues, both are only searched in a bounded window after
+            # the current position instead of the rest of the script
+            score = similarity(script_line, combined_subtitle)
+            next_script_index = script_index + 1
+            window_end = min(len(script_lines), script_index + _ALIGN_WINDOW)
+            while next_script_index < window_end and len(script_line) < len(
+                combined_subtitle
+            ):
+                candidate = script_line + " " + script_lines[next_script_index].strip()
+                candidate_score = similarity(candidate, combined_subtitle)
+                if candidate_score > score:
+                    script_line = candidate
+                    score = candidate_score
+                    next_script_index += 1
+                else:
+                    break
+
+            window_end = min(len(subtitle_items), subtitle_index + _ALIGN_WINDOW)
+            while (
+                next_script_index == script_index + 1
+                and next_subtitle_index < window_end
+            ):
                 next_subtitle = subtitle_items[next_subtitle_index][2].strip()
-                if similarity(
-                    script_line, combined_subtitle + " " + next_subtitle
-                ) > similarity(script_line, combined_subtitle):
-                    combined_subtitle += " " + next_subtitle
+                candidate = combined_subtitle + " " + next_subtitle
+                candidate_score = similarity(script_line, candidate)
+                if candidate_score > score:
+                    combined_subtitle = candidate
+                    score = candidate_score
                     end_time = subtitle_items[next_subtitle_index][1].split(" --> ")[1]
                     next_subtitle_index += 1
                 else:
                     break
 
-            if similarity(script_line, combined_subtitle) > 0.8:
+            if score > 0.8:
                 logger.warning(
                     f"Merged/Corrected - Script: {script_line}, Subtitle: {combined_subtitle}"
                 )
@@ -243,7 +294,7 @@ def correct(subtitle_file, video_script):
                 )
                 corrected = True
 
-            script_index += 1
+            script_index = next_script_index
             subtitle_index = next_subtitle_index
 
     # 处理剩余的脚本行
@@ -274,8 +325,10 @@ def correct(subtitle_file, video_script):
             for i, item in enumerate(new_subtitle_items):
                 fd.write(f"{i + 1}\n{item[1]}\n{item[2]}\n\n")
         logger.info("Subtitle corrected")
+        return new_subtitle_items
     else:
         logger.success("Subtitle is correct")
+        return subtitle_items
 
 
 if __name__ == "__main__":
@@ -1,18 +1,44 @@
+import hashlib
 import math
+import multiprocessing
 import os.path
 import re
+import shutil
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from os import path
 
-from edge_tts import SubMaker
+import orjson
+from cachetools import LRUCache
 from loguru import logger
 
 from app.config import config
 from app.models import const
 from app.models.schema import VideoConcatMode, VideoParams
-from app.services import llm, material, subtitle, video, voice
 from app.services import state as sm
 from app.utils import utils
 
+_TERMS_SPLIT_RE = re.compile(r"[,，]")
+
+# terms generated for recent scripts, keyed by a digest of subject and script
+_terms_cache = LRUCache(maxsize=256)
+_terms_cache_lock = threading.Lock()
+# the audio and materials cache manifest, loaded once into an index ordered
+# from least to most recently used entry; the lock guards both the index and
+# the file. The index only holds where each entry's data is, the data itself
+# is read on a hit
+_cache_lock = threading.Lock()
+_cache_index = None
+_cache_max_entries = int(config.app.get("task_cache_max_entries", 1000))
+_cache_max_age = int(config.app.get("task_cache_max_age", 7 * 24 * 3600))
+# a full cache is trimmed to this many entries, so the manifest is rewritten
+# once per tenth of the limit rather than on every store
+_cache_low_water = max(1, _cache_max_entries * 9 // 10)
+
+# runs the material downloads that overlap with the audio and subtitle generation
+_materials_executor = ThreadPoolExecutor(thread_name_prefix="materials")
+
 
 def generate_script(task_id, params):
     """Generate a video script based on provided parameters.
@@ -36,6 +62,8 @@ def generate_script(task_id, params):
         str or None: The generated video script if successful; otherwise, None.
     """
 
+    from app.services import llm
+
     logger.info("\n\n## generating video script")
     video_script = params.video_script.strip()
     if not video_script:
@@ -83,18 +111,16 @@ def generate_terms(task_id, params, video_script):
     logger.info("\n\n## generating video terms")
     video_terms = params.video_terms
     if not video_terms:
-        video_terms = llm.generate_terms(
-            video_subject=params.video_subject, video_script=video_script, amount=5
-        )
+        video_terms = _generate_terms_cached(params.video_subject, video_script)
     else:
         if isinstance(video_terms, str):
-            video_terms = [term.strip() for term in re.split(r"[,，]", video_terms)]
+            video_terms = list(map(str.strip, _TERMS_SPLIT_RE.split(video_terms)))
         elif isinstance(video_terms, list):
-            video_terms = [term.strip() for term in video_terms]
+            video_terms = list(map(str.strip, video_terms))
         else:
             raise ValueError("video_terms must be a string or a list of strings.")
 
-        logger.debug(f"video terms: {utils.to_json(video_terms)}")
+        logger.debug(f"video terms: {orjson.dumps(video_terms).decode()}")
 
     if not video_terms:
         sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
@@ -104,6 +130,53 @@ def generate_terms(task_id, params, video_script):
     return video_terms
 
 
+def _trim_for_terms(script, head=800, tail=400):
+    """Keep the leading and trailing sentences of a long script.
+
+    The topic of a script shows in its opening and closing sentences, sending
+    only those to the LLM keeps the terms prompt short for long scripts.
+    """
+
+    if len(script) <= head + tail:
+        return script
+
+    sentences = utils.split_sentences(script)
+    head_sentences, size = [], 0
+    while sentences and size < head:
+        sentence = sentences.pop(0)
+        head_sentences.append(sentence)
+        size += len(sentence)
+    tail_sentences, size = [], 0
+    while sentences and size < tail:
+        sentence = sentences.pop()
+        tail_sentences.insert(0, sentence)
+        size += len(sentence)
+    return " ".join(head_sentences + tail_sentences)
+
+
+def _generate_terms_cached(video_subject, video_script):
+    from app.services import llm
+
+    video_script = _trim_for_terms(video_script)
+    key = hashlib.blake2b(
+        f"{video_subject}\0{video_script}".encode(), digest_size=16
+    ).hexdigest()
+    with _terms_cache_lock:
+        video_terms = _terms_cache.get(key)
+    if video_terms:
+        logger.debug(f"video terms from cache: {video_terms}")
+        return list(video_terms)
+
+    video_terms = llm.generate_terms(
+        video_subject=video_subject, video_script=video_script, amount=5
+    )
+    # don't remember failures, the next run should ask the LLM again
+    if video_terms and isinstance(video_terms, list):
+        with _terms_cache_lock:
+            _terms_cache[key] = list(video_terms)
+    return video_terms
+
+
 def save_script_data(task_id, video_script, video_terms, params):
     """Save video script data to a JSON file.
 
@@ -115,19 +188,33 @@ def save_script_data(task_id, video_script, video_terms, params):
     Args:
         task_id (str): The identifier for the task.
         video_script (str): The video script to be saved.
-        video_terms (list): A list of search terms related to the video.
+        video_terms (list or None): A list of search terms related to the video,
+            None for local materials, which are saved without search terms.
         params (dict): Additional parameters to be included in the script data.
     """
 
     script_file = path.join(utils.task_dir(task_id), "script.json")
-    script_data = {
-        "script": video_script,
-        "search_terms": video_terms,
-        "params": params,
-    }
+    script_data = {"script": video_script, "params": params}
+    if video_terms:
+        script_data["search_terms"] = video_terms
 
-    with open(script_file, "w", encoding="utf-8") as f:
-        f.write(utils.to_json(script_data))
+    data = orjson.dumps(script_data, default=_json_default, option=orjson.OPT_INDENT_2)
+    fd = os.open(script_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+
+
+def _json_default(obj):
+    # the types orjson can't serialize natively, same fallbacks as utils.to_json
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    if isinstance(obj, bytes):
+        return "*** binary data ***"
+    if hasattr(obj, "__dict__"):
+        return obj.__dict__
+    raise TypeError
 
 
 def generate_audio(task_id, params, video_script):
@@ -154,11 +241,27 @@ def generate_audio(task_id, params, video_script):
             - object: The sub_maker object used for audio generation.
     """
 
+    from edge_tts import SubMaker
+
+    from app.services import voice
+
     logger.info("\n\n## generating audio")
     audio_file = path.join(utils.task_dir(task_id), "audio.mp3")
+    voice_name = voice.parse_voice_name(params.voice_name)
+    audio_key = _cache_key(video_script, voice_name, params.voice_rate)
+    cached = _cache_lookup("audio", audio_key)
+    if cached and path.isfile(cached["audio_file"]):
+        logger.info(f"using cached audio: {cached['audio_file']}")
+        _link_file(cached["audio_file"], audio_file)
+        sub_maker = SubMaker()
+        sub_maker.offset = [tuple(offset) for offset in cached["offset"]]
+        sub_maker.subs = cached["subs"]
+        audio_duration = math.ceil(voice.get_audio_duration(sub_maker))
+        return audio_file, audio_duration, sub_maker
+
     sub_maker = voice.tts(
         text=video_script,
-        voice_name=voice.parse_voice_name(params.voice_name),
+        voice_name=voice_name,
         voice_rate=params.voice_rate,
         voice_file=audio_file,
     )
@@ -172,10 +275,50 @@ def generate_audio(task_id, params, video_script):
         )
         return None, None, None
 
+    try:
+        cached_audio = path.join(
+            utils.storage_dir("cache_audio", create=True), f"{audio_key}.mp3"
+        )
+        _link_file(audio_file, cached_audio)
+        _cache_store(
+            "audio",
+            audio_key,
+            audio_file=cached_audio,
+            offset=sub_maker.offset,
+            subs=sub_maker.subs,
+        )
+    except Exception as e:
+        logger.warning(f"failed to cache audio: {str(e)}")
+
     audio_duration = math.ceil(voice.get_audio_duration(sub_maker))
     return audio_file, audio_duration, sub_maker
 
 
+def estimate_audio_duration(video_script, voice_rate=1.0):
+    """Estimate the spoken duration of a script before it is synthesized.
+
+    Space separated languages are estimated at about 2.5 words per second,
+    others (Chinese, Japanese...) at about 4.5 characters per second. The
+    estimate is only used to size the material downloads, the clips are
+    looped if the real audio turns out to be longer.
+
+    Args:
+        video_script (str): The script that will be converted to audio.
+        voice_rate (float?): The speaking rate of the voice. Defaults to 1.0.
+
+    Returns:
+        int: The estimated duration of the audio in seconds.
+    """
+
+    words = len(video_script.split())
+    chars = len(re.sub(r"\s", "", video_script))
+    if chars > words * 10:
+        duration = chars / 4.5
+    else:
+        duration = words / 2.5
+    return math.ceil(duration * 1.1 / (voice_rate or 1.0))
+
+
 def generate_subtitle(task_id, params, video_script, sub_maker, audio_file):
     """Generate subtitles for a video based on the provided parameters.
 
@@ -200,6 +343,8 @@ def generate_subtitle(task_id, params, video_script, sub_maker, audio_file):
             subtitles are not enabled or if the subtitle file is invalid.
     """
 
+    from app.services import subtitle, voice
+
     if not params.subtitle_enabled:
         return ""
 
@@ -208,20 +353,30 @@ def generate_subtitle(task_id, params, video_script, sub_maker, audio_file):
     logger.info(f"\n\n## generating subtitle, provider: {subtitle_provider}")
 
     subtitle_fallback = False
+    srt = None
+    subtitle_lines = None
     if subtitle_provider == "edge":
-        voice.create_subtitle(
+        srt = voice.create_subtitle(
             text=video_script, sub_maker=sub_maker, subtitle_file=subtitle_path
         )
-        if not os.path.exists(subtitle_path):
+        if not srt:
+            srt = None
             subtitle_fallback = True
             logger.warning("subtitle file not found, fallback to whisper")
 
     if subtitle_provider == "whisper" or subtitle_fallback:
-        subtitle.create(audio_file=audio_file, subtitle_file=subtitle_path)
+        _, subtitle_lines = subtitle.create(
+            audio_file=audio_file, subtitle_file=subtitle_path
+        )
         logger.info("\n\n## correcting subtitle")
-        subtitle.correct(subtitle_file=subtitle_path, video_script=video_script)
+        subtitle_lines = subtitle.correct(
+            subtitle_file=subtitle_path,
+            video_script=video_script,
+            subtitle_items=subtitle_lines,
+        )
 
-    subtitle_lines = subtitle.file_to_subtitles(subtitle_path)
+    if subtitle_lines is None:
+        subtitle_lines = subtitle.file_to_subtitles(subtitle_path, from_text=srt)
     if not subtitle_lines:
         logger.warning(f"subtitle file is invalid: {subtitle_path}")
         return ""
@@ -229,7 +384,9 @@ def generate_subtitle(task_id, params, video_script, sub_maker, audio_file):
     return subtitle_path
 
 
-def get_video_materials(task_id, params, video_terms, audio_duration):
+def get_video_materials(
+    task_id, params, video_terms, audio_duration, cancel_event=None, remaining_items=None
+):
     """Retrieve video materials based on the specified parameters.
 
     This function processes video materials either from a local source or by
@@ -237,35 +394,52 @@ def get_video_materials(task_id, params, video_terms, audio_duration):
     local, it preprocesses the provided materials and returns their URLs. If
     the source is remote, it attempts to download videos based on the
     provided search terms and parameters. In case of failure to find valid
-    materials or download videos, it updates the task state to failed and
-    logs an error message.
+    materials or download videos, it logs an error message.
 
     Args:
         task_id (str): The identifier for the task being processed.
         params (object): An object containing various parameters including video source,
             materials, and durations.
-        video_terms (list): A list of terms used for searching videos if downloading from a remote
-            source.
+        video_terms (list or None): A list of terms used for searching videos if downloading
+            from a remote source, None for local materials.
         audio_duration (int): The duration of the audio to be used in the video processing.
+        cancel_event (threading.Event?): Stops the downloads early once set.
+        remaining_items (list?): Receives the search results that were not
+            downloaded, for material.download_more_videos.
 
     Returns:
         list or None: A list of URLs of the processed video materials if
-            successful, otherwise None.
+            successful, otherwise None. The caller marks the task as failed,
+            this may run in a background thread while the task goes on.
     """
 
+    from app.services import material, video
+
     if params.video_source == "local":
         logger.info("\n\n## preprocess local materials")
         materials = video.preprocess_video(
             materials=params.video_materials, clip_duration=params.video_clip_duration
         )
         if not materials:
-            sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
             logger.error(
                 "no valid materials found, please check the materials and try again."
             )
             return None
         return [material_info.url for material_info in materials]
     else:
+        materials_key = _cache_key(
+            params.video_source,
+            sorted(video_terms),
+            params.video_aspect,
+            params.video_concat_mode,
+            params.video_clip_duration,
+            audio_duration * params.video_count,
+        )
+        cached = _cache_lookup("materials", materials_key)
+        if cached and all(path.isfile(p) for p in cached["materials"]):
+            logger.info(f"using {len(cached['materials'])} cached videos")
+            return cached["materials"]
+
         logger.info(f"\n\n## downloading videos from {params.video_source}")
         downloaded_videos = material.download_videos(
             task_id=task_id,
@@ -275,18 +449,225 @@ def get_video_materials(task_id, params, video_terms, audio_duration):
             video_contact_mode=params.video_concat_mode,
             audio_duration=audio_duration * params.video_count,
             max_clip_duration=params.video_clip_duration,
+            cancel_event=cancel_event,
+            remaining_items=remaining_items,
         )
+        if cancel_event is not None and cancel_event.is_set():
+            return None
         if not downloaded_videos:
-            sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
             logger.error(
                 "failed to download videos, maybe the network is not available. if you are in China, please use a VPN."
             )
             return None
+        _cache_store("materials", materials_key, materials=downloaded_videos)
         return downloaded_videos
 
 
+def _cache_key(*parts):
+    return hashlib.blake2b(orjson.dumps(parts), digest_size=12).hexdigest()
+
+
+def _cache_manifest(create=False):
+    return path.join(utils.storage_dir("cache_tasks", create=create), "manifest.jsonl")
+
+
+def _load_cache_index():
+    # later lines for the same key replace earlier ones
+    global _cache_index
+    if _cache_index is not None:
+        return _cache_index
+    records = {}
+    lines = 0
+    try:
+        with open(_cache_manifest(), "rb") as f:
+            for line in f:
+                lines += 1
+                try:
+                    record = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    continue
+                if "path" in record:
+                    records[(record["kind"], record["key"])] = record
+    except FileNotFoundError:
+        pass
+    _cache_index = {
+        (record["kind"], record["key"]): record
+        for record in sorted(records.values(), key=lambda record: record["atime"])
+    }
+    # compacted on startup: replaced lines and expired entries are dropped
+    if not _evict_cache_entries(_cache_max_entries) and lines > len(_cache_index):
+        _write_cache_manifest()
+    return _cache_index
+
+
+def _evict_cache_entries(max_entries):
+    """Drop the expired entries and the least recently used ones over `max_entries`.
+
+    Dropped entries take their data file, and audio entries their file in
+    cache_audio, with them. The materials are shared downloads and stay. The
+    manifest is rewritten without the dropped entries.
+
+    Returns:
+        int: The number of entries dropped.
+    """
+
+    expired_before = time.time() - _cache_max_age
+    evicted = []
+    for index_key, record in list(_cache_index.items()):
+        if len(_cache_index) <= max_entries and record["atime"] >= expired_before:
+            break
+        evicted.append(_cache_index.pop(index_key))
+    if not evicted:
+        return 0
+
+    cache_audio_dir = utils.storage_dir("cache_audio")
+    for record in evicted:
+        files = [record["path"]]
+        if record["kind"] == "audio":
+            files.append(path.join(cache_audio_dir, f"{record['key']}.mp3"))
+        for file in files:
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                pass
+
+    _write_cache_manifest()
+    logger.debug(
+        f"evicted {len(evicted)} cache entries, "
+        f"{sum(record['size'] for record in evicted)} bytes"
+    )
+    return len(evicted)
+
+
+def _write_cache_manifest():
+    manifest = _cache_manifest(create=True)
+    with open(f"{manifest}.tmp", "wb") as f:
+        for record in _cache_index.values():
+            f.write(orjson.dumps(record) + b"\n")
+    os.replace(f"{manifest}.tmp", manifest)
+
+
+def _cache_lookup(kind, key):
+    """Find the cached data of a kind for a content key, or None."""
+
+    with _cache_lock:
+        index = _load_cache_index()
+        record = index.pop((kind, key), None)
+        if record is None:
+            return None
+        try:
+            with open(record["path"], "rb") as f:
+                data = orjson.loads(f.read())
+        except (OSError, orjson.JSONDecodeError):
+            # the entry is rewritten by the next store of the key
+            return None
+        # the new access time is saved by the next manifest rewrite
+        record["atime"] = int(time.time())
+        index[(kind, key)] = record
+        return data
+
+
+def _cache_store(kind, key, **data):
+    payload = orjson.dumps(data)
+    data_file = path.join(
+        utils.storage_dir("cache_tasks", create=True), f"{kind}-{key}.json"
+    )
+    size = len(payload)
+    if data.get("audio_file"):
+        size += path.getsize(data["audio_file"])
+    record = {
+        "kind": kind,
+        "key": key,
+        "path": data_file,
+        "size": size,
+        "atime": int(time.time()),
+    }
+    with _cache_lock:
+        with open(f"{data_file}.tmp", "wb") as f:
+            f.write(payload)
+        os.replace(f"{data_file}.tmp", data_file)
+
+        index = _load_cache_index()
+        index.pop((kind, key), None)
+        index[(kind, key)] = record
+        # one O_APPEND write per entry, concurrent tasks never interleave lines
+        fd = os.open(
+            _cache_manifest(create=True), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644
+        )
+        try:
+            os.write(fd, orjson.dumps(record) + b"\n")
+        finally:
+            os.close(fd)
+        if len(index) > _cache_max_entries:
+            _evict_cache_entries(_cache_low_water)
+
+
+def _link_file(src, dst):
+    if path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class _ProgressBatcher:
+    """Coalesce the progress updates of a task.
+
+    Progress is written at most once per `min_interval` seconds, the latest
+    value is written by a timer once the interval has passed. Terminal states
+    go through `finish`, which drops any pending progress so it can't
+    overwrite the final state.
+    """
+
+    def __init__(self, task_id, min_interval=0.25):
+        self._task_id = task_id
+        self._min_interval = min_interval
+        self._lock = threading.Lock()
+        self._pending = None
+        self._last_write = 0.0
+        self._timer = None
+
+    def set(self, progress):
+        with self._lock:
+            self._pending = progress
+            wait = self._last_write + self._min_interval - time.monotonic()
+            if wait <= 0:
+                self._write()
+            elif self._timer is None:
+                self._timer = threading.Timer(wait, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            self._write()
+
+    def finish(self, state, **kwargs):
+        with self._lock:
+            self._pending = None
+            self._cancel_timer()
+            sm.state.update_task(self._task_id, state=state, **kwargs)
+
+    def _write(self):
+        self._cancel_timer()
+        if self._pending is not None:
+            sm.state.update_task(
+                self._task_id,
+                state=const.TASK_STATE_PROCESSING,
+                progress=self._pending,
+            )
+            self._pending = None
+            self._last_write = time.monotonic()
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+
 def generate_final_videos(
-        task_id, params, downloaded_videos, audio_file, subtitle_path
+        task_id, params, downloaded_videos, audio_file, subtitle_path, progress=None
 ):
     """Generate final video files from downloaded videos and audio.
 
@@ -304,6 +685,8 @@ def generate_final_videos(
         downloaded_videos (list): A list of paths to the downloaded video files.
         audio_file (str): The path to the audio file to be used in the final videos.
         subtitle_path (str): The path to the subtitle file to be included in the final videos.
+        progress (_ProgressBatcher?): Receives the progress updates, a new one
+            is used when omitted.
 
     Returns:
         tuple: A tuple containing two lists:
@@ -311,50 +694,132 @@ def generate_final_videos(
             - list: Paths to the combined video files.
     """
 
-    final_video_paths = []
-    combined_video_paths = []
+    from app.services import video
+
     video_concat_mode = (
         params.video_concat_mode if params.video_count == 1 else VideoConcatMode.random
     )
+    # detected once here, not again in every worker process
+    encoder = video.detect_hwaccel()
+    render_args = (params, downloaded_videos, audio_file, subtitle_path, encoder)
+    if progress is None:
+        progress = _ProgressBatcher(task_id)
+
+    # task_dir never ends with a separator, so this is what path.join builds
+    task_root = f"{utils.task_dir(task_id)}{os.sep}"
+    indexes = range(1, params.video_count + 1)
+    combined_video_paths = [f"{task_root}combined-{i}.mp4" for i in indexes]
+    final_video_paths = [f"{task_root}final-{i}.mp4" for i in indexes]
+
+    cpu_count = os.cpu_count() or 1
+    n_threads = max(1, params.n_threads or 2)
+    if params.video_count == 1:
+        _render_one(
+            combined_video_paths[0],
+            final_video_paths[0],
+            *render_args,
+            video_concat_mode,
+            params.n_threads,
+            max(1, cpu_count // n_threads),
+            on_combined=lambda: progress.set(75),
+        )
+        # the task's final COMPLETE update is the one that reports 100
+        progress.flush()
+        return final_video_paths, combined_video_paths
+
+    # every output is independent, render them in separate processes and split
+    # the cpus between the workers so the encoders don't oversubscribe them
+    max_workers = min(params.video_count, max(1, cpu_count // n_threads))
+    threads = max(1, min(n_threads, cpu_count // max_workers))
+    # the ffmpeg processes each worker runs at once share its part of the cpus
+    segment_workers = max(1, cpu_count // max_workers // threads)
 
     _progress = 50
-    for i in range(params.video_count):
-        index = i + 1
-        combined_video_path = path.join(
-            utils.task_dir(task_id), f"combined-{index}.mp4"
-        )
-        logger.info(f"\n\n## combining video: {index} => {combined_video_path}")
-        video.combine_videos(
-            combined_video_path=combined_video_path,
-            video_paths=downloaded_videos,
-            audio_file=audio_file,
-            video_aspect=params.video_aspect,
-            video_concat_mode=video_concat_mode,
-            max_clip_duration=params.video_clip_duration,
-            threads=params.n_threads,
-        )
+    # spawn, forking a process that runs task threads and pooled sockets is unsafe
+    with ProcessPoolExecutor(
+        max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        futures = [
+            executor.submit(
+                _render_one,
+                combined_video_path,
+                final_video_path,
+                *render_args,
+                video_concat_mode,
+                threads,
+                segment_workers,
+            )
+            for combined_video_path, final_video_path in zip(
+                combined_video_paths, final_video_paths
+            )
+        ]
+        for future in as_completed(futures):
+            future.result()
+            _progress += 50 / params.video_count
+            if _progress < 100:
+                progress.set(_progress)
+    progress.flush()
 
-        _progress += 50 / params.video_count / 2
-        sm.state.update_task(task_id, progress=_progress)
+    return final_video_paths, combined_video_paths
 
-        final_video_path = path.join(utils.task_dir(task_id), f"final-{index}.mp4")
 
-        logger.info(f"\n\n## generating video: {index} => {final_video_path}")
-        video.generate_video(
-            video_path=combined_video_path,
-            audio_path=audio_file,
-            subtitle_path=subtitle_path,
-            output_file=final_video_path,
-            params=params,
-        )
+def _render_one(
+        combined_video_path,
+        final_video_path,
+        params,
+        downloaded_videos,
+        audio_file,
+        subtitle_path,
+        encoder,
+        video_concat_mode,
+        threads,
+        segment_workers,
+        on_combined=None,
+):
+    """Combine the materials and render a single final video.
 
-        _progress += 50 / params.video_count / 2
-        sm.state.update_task(task_id, progress=_progress)
+    Runs in a worker process when several videos are generated, so it only
+    writes files and leaves the task state to the caller. The audio is not
+    decoded here, combining only probes its duration and generate_video
+    opens it when it has to fall back to moviepy. `on_combined` is called
+    between the two steps when rendering in the task's own process.
+    """
 
-        final_video_paths.append(final_video_path)
-        combined_video_paths.append(combined_video_path)
+    from app.services import video
+
+    logger.info(f"\n\n## combining video: {combined_video_path}")
+    video.combine_videos(
+        combined_video_path=combined_video_path,
+        video_paths=downloaded_videos,
+        audio_file=audio_file,
+        video_aspect=params.video_aspect,
+        video_concat_mode=video_concat_mode,
+        max_clip_duration=params.video_clip_duration,
+        threads=threads,
+        encoder=encoder,
+        segment_workers=segment_workers,
+    )
+    if on_combined is not None:
+        on_combined()
+
+    logger.info(f"\n\n## generating video: {final_video_path}")
+    if threads != params.n_threads:
+        params = params.model_copy(update={"n_threads": threads})
+    video.generate_video(
+        video_path=combined_video_path,
+        audio_path=audio_file,
+        subtitle_path=subtitle_path,
+        output_file=final_video_path,
+        params=params,
+        encoder=encoder,
+    )
 
-    return final_video_paths, combined_video_paths
+
+def _materials_failed(materials_future) -> bool:
+    # a background download that already finished without any materials
+    if materials_future is None or not materials_future.done():
+        return False
+    return materials_future.exception() is not None or not materials_future.result()
 
 
 def start(task_id, params: VideoParams, stop_at: str = "video"):
@@ -386,7 +851,8 @@ def start(task_id, params: VideoParams, stop_at: str = "video"):
     """
 
     logger.info(f"start task: {task_id}, stop_at: {stop_at}")
-    sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=5)
+    progress = _ProgressBatcher(task_id)
+    progress.set(5)
 
     if type(params.video_concat_mode) is str:
         params.video_concat_mode = VideoConcatMode(params.video_concat_mode)
@@ -394,92 +860,141 @@ def start(task_id, params: VideoParams, stop_at: str = "video"):
     # 1. Generate script
     video_script = generate_script(task_id, params)
     if not video_script:
-        sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+        progress.finish(state=const.TASK_STATE_FAILED)
         return
 
-    sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=10)
+    progress.set(10)
 
     if stop_at == "script":
-        sm.state.update_task(
-            task_id, state=const.TASK_STATE_COMPLETE, progress=100, script=video_script
+        progress.finish(
+            state=const.TASK_STATE_COMPLETE, progress=100, script=video_script
         )
         return {"script": video_script}
 
     # 2. Generate terms
-    video_terms = ""
+    video_terms = None
     if params.video_source != "local":
         video_terms = generate_terms(task_id, params, video_script)
         if not video_terms:
-            sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+            progress.finish(state=const.TASK_STATE_FAILED)
             return
 
     save_script_data(task_id, video_script, video_terms, params)
 
     if stop_at == "terms":
-        sm.state.update_task(
-            task_id, state=const.TASK_STATE_COMPLETE, progress=100, terms=video_terms
+        progress.finish(
+            state=const.TASK_STATE_COMPLETE, progress=100, terms=video_terms
         )
         return {"script": video_script, "terms": video_terms}
 
-    sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=20)
+    progress.set(20)
+
+    # materials only need the terms and a rough duration, fetch them while
+    # the audio and the subtitle are being generated
+    materials_future = None
+    estimated_duration = 0
+    cancel_event = threading.Event()
+    # the search results the early download leaves, for a longer audio
+    remaining_items = []
+    if stop_at in ("materials", "video"):
+        estimated_duration = estimate_audio_duration(video_script, params.voice_rate)
+        materials_future = _materials_executor.submit(
+            get_video_materials,
+            task_id,
+            params,
+            video_terms,
+            estimated_duration,
+            cancel_event,
+            remaining_items,
+        )
 
-    # 3. Generate audio
-    audio_file, audio_duration, sub_maker = generate_audio(task_id, params, video_script)
-    if not audio_file:
-        sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
-        return
+    # the downloads stop once the task fails or no longer needs them
+    try:
+        # 3. Generate audio
+        audio_file, audio_duration, sub_maker = generate_audio(
+            task_id, params, video_script
+        )
+        if not audio_file or _materials_failed(materials_future):
+            progress.finish(state=const.TASK_STATE_FAILED)
+            return
 
-    sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=30)
+        progress.set(30)
 
-    if stop_at == "audio":
-        sm.state.update_task(
-            task_id,
-            state=const.TASK_STATE_COMPLETE,
-            progress=100,
-            audio_file=audio_file,
+        if stop_at == "audio":
+            progress.finish(
+                state=const.TASK_STATE_COMPLETE,
+                progress=100,
+                audio_file=audio_file,
+            )
+            return {"audio_file": audio_file, "audio_duration": audio_duration}
+
+        # 4. Generate subtitle
+        subtitle_path = generate_subtitle(
+            task_id, params, video_script, sub_maker, audio_file
         )
-        return {"audio_file": audio_file, "audio_duration": audio_duration}
 
-    # 4. Generate subtitle
-    subtitle_path = generate_subtitle(task_id, params, video_script, sub_maker, audio_file)
+        if stop_at == "subtitle":
+            progress.finish(
+                state=const.TASK_STATE_COMPLETE,
+                progress=100,
+                subtitle_path=subtitle_path,
+            )
+            return {"subtitle_path": subtitle_path}
 
-    if stop_at == "subtitle":
-        sm.state.update_task(
-            task_id,
-            state=const.TASK_STATE_COMPLETE,
-            progress=100,
-            subtitle_path=subtitle_path,
-        )
-        return {"subtitle_path": subtitle_path}
+        if _materials_failed(materials_future):
+            progress.finish(state=const.TASK_STATE_FAILED)
+            return
 
-    sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=40)
+        progress.set(40)
+
+        # 5. Get video materials
+        if materials_future is not None:
+            downloaded_videos = materials_future.result()
+            shortfall = audio_duration - estimated_duration
+            # local materials are looped to the audio instead
+            if downloaded_videos and shortfall > 0 and params.video_source != "local":
+                from app.services import material
+
+                # only the shortfall, from the results of the first search
+                logger.info(
+                    f"audio is {shortfall:.1f} seconds longer than estimated, "
+                    f"downloading more materials"
+                )
+                downloaded_videos = downloaded_videos + material.download_more_videos(
+                    task_id=task_id,
+                    video_items=remaining_items,
+                    audio_duration=shortfall * params.video_count,
+                    max_clip_duration=params.video_clip_duration,
+                    cancel_event=cancel_event,
+                )
+        else:
+            downloaded_videos = get_video_materials(
+                task_id, params, video_terms, audio_duration
+            )
+    finally:
+        cancel_event.set()
 
-    # 5. Get video materials
-    downloaded_videos = get_video_materials(
-        task_id, params, video_terms, audio_duration
-    )
     if not downloaded_videos:
-        sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+        progress.finish(state=const.TASK_STATE_FAILED)
         return
 
     if stop_at == "materials":
-        sm.state.update_task(
-            task_id,
+        progress.finish(
             state=const.TASK_STATE_COMPLETE,
             progress=100,
             materials=downloaded_videos,
         )
         return {"materials": downloaded_videos}
 
-    sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=50)
+    progress.set(50)
 
     # 6. Generate final videos
     final_video_paths, combined_video_paths = generate_final_videos(
-        task_id, params, downloaded_videos, audio_file, subtitle_path
+        task_id, params, downloaded_videos, audio_file, subtitle_path, progress
     )
 
     if not final_video_paths:
-        sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+        progress.finish(state=const.TASK_STATE_FAILED)
         return
 
     logger.success(
@@ -496,9 +1011,7 @@ def start(task_id, params: VideoParams, stop_at: str = "video"):
         "subtitle_path": subtitle_path,
         "materials": downloaded_videos,
     }
-    sm.state.update_task(
-        task_id, state=const.TASK_STATE_COMPLETE, progress=100, **kwargs
-    )
+    progress.finish(state=const.TASK_STATE_COMPLETE, progress=100, **kwargs)
     return kwargs
 
 
@@ -1,17 +1,137 @@
-import glob
+import functools
 import random
+import re
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 
+import numpy as np
 from loguru import logger
 from moviepy.editor import *
-from moviepy.video.tools.subtitles import SubtitlesClip
-from PIL import ImageFont
+from PIL import Image, ImageColor, ImageDraw, ImageFont
 
+from app.config import config
 from app.models import const
 from app.models.schema import MaterialInfo, VideoAspect, VideoConcatMode, VideoParams
 from app.utils import utils
 
 
+# hardware h264 encoders in order of preference, with their encoder options.
+# VAAPI is left out, it needs a device and an hwupload filter moviepy can't pass
+_HWACCEL_ENCODERS = {
+    # -delay 0 hands frames back as soon as they are encoded instead of
+    # queueing them behind the lookahead
+    "h264_nvenc": [
+        "-preset", "p4", "-tune", "hq", "-rc", "vbr", "-cq", "23", "-delay", "0"
+    ],
+    "h264_videotoolbox": ["-b:v", "6M"],
+    "h264_qsv": ["-preset", "faster", "-global_quality", "25"],
+}
+_SOFTWARE_ENCODER = "libx264"
+# superfast trades ~5-10% larger files for several times less encode time,
+# fastdecode keeps the intermediate combined video cheap to decode again
+_SOFTWARE_ENCODER_PARAMS = ["-preset", "superfast", "-tune", "fastdecode"]
+
+
+def _encoder_params(encoder: str) -> List[str]:
+    params = _HWACCEL_ENCODERS.get(encoder)
+    if params is None:
+        params = _SOFTWARE_ENCODER_PARAMS if encoder == _SOFTWARE_ENCODER else []
+    # moov atom up front, the videos are streamed by the download endpoints
+    return [*params, "-movflags", "+faststart"]
+
+
+def _moviepy_encoder_args(encoder: str) -> dict:
+    """Split the encoder params into write_videofile's preset and ffmpeg_params.
+
+    MoviePy always passes a `-preset` of its own ("medium" unless told
+    otherwise), so it is taken out of the extra params rather than repeated.
+    """
+    params = _encoder_params(encoder)
+    preset = "medium"
+    if "-preset" in params:
+        i = params.index("-preset")
+        preset = params[i + 1]
+        params = params[:i] + params[i + 2 :]
+    return {"preset": preset, "ffmpeg_params": params}
+
+
+# parsed from the banner `ffmpeg -i` prints, ffprobe is not bundled with imageio
+_DURATION_RE = re.compile(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)")
+_VIDEO_CODEC_RE = re.compile(r"Stream #\S+.*?: Video: (\w+)")
+# one srt cue: the timing line and the text up to the next blank line
+_SRT_CUE_RE = re.compile(
+    r"(\d+):(\d+):(\d+)[,.](\d+)\s*-->\s*(\d+):(\d+):(\d+)[,.](\d+)[^\n]*\n(.*?)(?:\n[ \t]*\n|\Z)",
+    re.S,
+)
+
+
+def _ffmpeg_exe() -> str:
+    import imageio_ffmpeg
+
+    # honours IMAGEIO_FFMPEG_EXE, which is set from the ffmpeg_path config
+    return imageio_ffmpeg.get_ffmpeg_exe()
+
+
+@functools.lru_cache(maxsize=1)
+def detect_hwaccel() -> str:
+    """Pick the h264 encoder used to write videos.
+
+    The `video_encoder` config wins when set. Otherwise the hardware encoders
+    ffmpeg was built with are tried with a one frame trial encode, builds
+    list encoders like nvenc even when there is no gpu to run them. Falls
+    back to libx264.
+
+    Returns:
+        str: The name of the ffmpeg encoder.
+    """
+
+    encoder = config.app.get("video_encoder", "").strip()
+    if encoder:
+        return encoder
+
+    try:
+        ffmpeg = _ffmpeg_exe()
+        encoders = subprocess.run(
+            [ffmpeg, "-hide_banner", "-encoders"],
+            capture_output=True,
+            text=True,
+            timeout=10,
+        ).stdout
+        for encoder in _HWACCEL_ENCODERS:
+            if encoder in encoders and _trial_encode(ffmpeg, encoder):
+                logger.info(f"using hardware video encoder: {encoder}")
+                return encoder
+    except Exception as e:
+        logger.warning(f"failed to detect hardware video encoders: {str(e)}")
+    return _SOFTWARE_ENCODER
+
+
+def _trial_encode(ffmpeg: str, encoder: str) -> bool:
+    cmd = [
+        ffmpeg,
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-f",
+        "lavfi",
+        "-i",
+        "color=black:s=256x256:d=0.1",
+        "-frames:v",
+        "1",
+        "-c:v",
+        encoder,
+        "-f",
+        "null",
+        "-",
+    ]
+    try:
+        return subprocess.run(cmd, capture_output=True, timeout=20).returncode == 0
+    except Exception:
+        return False
+
+
 def get_bgm_file(bgm_type: str = "random", bgm_file: str = ""):
     """Retrieve a background music (BGM) file based on the specified type.
 
@@ -39,14 +159,24 @@ def get_bgm_file(bgm_type: str = "random", bgm_file: str = ""):
         return bgm_file
 
     if bgm_type == "random":
-        suffix = "*.mp3"
         song_dir = utils.song_dir()
-        files = glob.glob(os.path.join(song_dir, suffix))
-        return random.choice(files)
+        # the listing is only read again when a song is added or removed
+        files = _list_songs(song_dir, os.stat(song_dir).st_mtime_ns)
+        return random.choice(files) if files else ""
 
     return ""
 
 
+@functools.lru_cache(maxsize=1)
+def _list_songs(song_dir: str, mtime: int) -> tuple:
+    with os.scandir(song_dir) as entries:
+        return tuple(
+            entry.path
+            for entry in entries
+            if entry.name.endswith(".mp3") and entry.is_file()
+        )
+
+
 def combine_videos(
     combined_video_path: str,
     video_paths: List[str],
@@ -55,6 +185,8 @@ def combine_videos(
     video_concat_mode: VideoConcatMode = VideoConcatMode.random,
     max_clip_duration: int = 5,
     threads: int = 2,
+    encoder: str = None,
+    segment_workers: int = None,
 ) -> str:
     """Combine multiple video clips into a single video synchronized with an
     audio file.
@@ -77,62 +209,97 @@ def combine_videos(
             VideoConcatMode.random.
         max_clip_duration (int?): The maximum duration for each video clip segment in seconds. Defaults to
             5.
-        threads (int?): The number of threads to use for writing the video file. Defaults to 2.
+        threads (int?): The number of threads each encoding process uses. Defaults to 2.
+        encoder (str?): The ffmpeg video encoder. Defaults to the one picked by detect_hwaccel.
+        segment_workers (int?): How many segments ffmpeg prepares at once. Defaults to the
+            cpu count divided by threads, callers running several combines at once pass
+            their share.
 
     Returns:
         str: The file path of the combined video.
     """
 
-    audio_clip = AudioFileClip(audio_file)
-    audio_duration = audio_clip.duration
+    # only the duration is needed, the audio itself is muxed by generate_video
+    audio_duration = _probe_duration(audio_file)
+    if audio_duration is None:
+        audio_clip = AudioFileClip(audio_file)
+        audio_duration = audio_clip.duration
+        audio_clip.close()
     logger.info(f"max duration of audio: {audio_duration} seconds")
-    # Required duration of each clip
-    req_dur = audio_duration / len(video_paths)
-    req_dur = max_clip_duration
-    logger.info(f"each clip will be maximum {req_dur} seconds long")
+    logger.info(f"each clip will be maximum {max_clip_duration} seconds long")
     output_dir = os.path.dirname(combined_video_path)
 
     aspect = VideoAspect(video_aspect)
     video_width, video_height = aspect.to_resolution()
 
+    encoder = encoder or detect_hwaccel()
+    if _ffmpeg_combine(
+        combined_video_path=combined_video_path,
+        video_paths=video_paths,
+        audio_duration=audio_duration,
+        video_width=video_width,
+        video_height=video_height,
+        video_concat_mode=video_concat_mode,
+        max_clip_duration=max_clip_duration,
+        threads=threads,
+        encoder=encoder,
+        max_workers=segment_workers,
+    ):
+        logger.success("completed")
+        return combined_video_path
+
     clips = []
     video_duration = 0
 
-    raw_clips = []
-    for video_path in video_paths:
-        clip = VideoFileClip(video_path).without_audio()
-        clip_duration = clip.duration
-        start_time = 0
-
-        while start_time < clip_duration:
-            end_time = min(start_time + max_clip_duration, clip_duration)
-            split_clip = clip.subclip(start_time, end_time)
-            raw_clips.append(split_clip)
-            # logger.info(f"splitting from {start_time:.2f} to {end_time:.2f}, clip duration {clip_duration:.2f}, split_clip duration {split_clip.duration:.2f}")
-            start_time = end_time
-            if video_concat_mode.value == VideoConcatMode.sequential.value:
-                break
-
-    # random video_paths order
-    if video_concat_mode.value == VideoConcatMode.random.value:
-        random.shuffle(raw_clips)
-
-    # Add downloaded clips over and over until the duration of the audio (max_duration) has been reached
-    while video_duration < audio_duration:
-        for clip in raw_clips:
-            # Check if clip is longer than the remaining audio
-            if (audio_duration - video_duration) < clip.duration:
-                clip = clip.subclip(0, (audio_duration - video_duration))
-            # Only shorten clips if the calculated clip length (req_dur) is shorter than the actual clip to prevent still image
-            elif req_dur < clip.duration:
-                clip = clip.subclip(0, req_dur)
-            clip = clip.set_fps(30)
+    source_clips = {}
+    try:
+        raw_clips = []
+        for video_path in video_paths:
+            # one reader per file, a path listed twice shares it
+            clip = source_clips.get(video_path)
+            if clip is None:
+                if _is_image(video_path):
+                    clip = _zoom_image_clip(video_path, max_clip_duration)
+                else:
+                    clip = VideoFileClip(video_path).without_audio()
+                source_clips[video_path] = clip
+            clip_duration = clip.duration
+            start_time = 0
+
+            while start_time < clip_duration:
+                end_time = min(start_time + max_clip_duration, clip_duration)
+                split_clip = clip.subclip(start_time, end_time)
+                raw_clips.append(split_clip)
+                # logger.info(f"splitting from {start_time:.2f} to {end_time:.2f}, clip duration {clip_duration:.2f}, split_clip duration {split_clip.duration:.2f}")
+                start_time = end_time
+                if video_concat_mode.value == VideoConcatMode.sequential.value:
+                    break
+
+        # random video_paths order
+        if video_concat_mode.value == VideoConcatMode.random.value:
+            random.shuffle(raw_clips)
+
+        # Add downloaded clips over and over until the duration of the audio (max_duration) has been reached.
+        # The clips are picked first, so only the ones that make it into the video get resized
+        timeline = []
+        while raw_clips and video_duration < audio_duration:
+            for clip in raw_clips:
+                # Clips are at most max_clip_duration long, the last one is cut to the remaining audio
+                length = min(clip.duration, max_clip_duration, audio_duration - video_duration)
+                if length <= 0:
+                    break
+                timeline.append((clip, length))
+                video_duration += length
+
+        video_ratio = video_width / video_height
+        for clip, length in timeline:
+            if length < clip.duration:
+                clip = clip.subclip(0, length)
 
             # Not all videos are same size, so we need to resize them
             clip_w, clip_h = clip.size
             if clip_w != video_width or clip_h != video_height:
-                clip_ratio = clip.w / clip.h
-                video_ratio = video_width / video_height
+                clip_ratio = clip_w / clip_h
 
                 if clip_ratio == video_ratio:
                     # 等比例缩放
@@ -150,43 +317,310 @@ def combine_videos(
                     new_height = int(clip_h * scale_factor)
                     clip_resized = clip.resize(newsize=(new_width, new_height))
 
-                    background = ColorClip(
-                        size=(video_width, video_height), color=(0, 0, 0)
-                    )
-                    clip = CompositeVideoClip(
-                        [
-                            background.set_duration(clip.duration),
-                            clip_resized.set_position("center"),
-                        ]
+                    # 黑边居中，margin 直接填充，不再逐帧合成背景
+                    pad_x = video_width - new_width
+                    pad_y = video_height - new_height
+                    clip = vfx.margin(
+                        clip_resized,
+                        left=pad_x // 2,
+                        right=pad_x - pad_x // 2,
+                        top=pad_y // 2,
+                        bottom=pad_y - pad_y // 2,
+                        color=(0, 0, 0),
                     )
 
                 logger.info(
                     f"resizing video to {video_width} x {video_height}, clip size: {clip_w} x {clip_h}"
                 )
 
-            if clip.duration > max_clip_duration:
-                clip = clip.subclip(0, max_clip_duration)
-
             clips.append(clip)
-            video_duration += clip.duration
 
-    video_clip = concatenate_videoclips(clips)
-    video_clip = video_clip.set_fps(30)
-    logger.info("writing")
-    # https://github.com/harry0703/MoneyPrinterTurbo/issues/111#issuecomment-2032354030
-    video_clip.write_videofile(
-        filename=combined_video_path,
-        threads=threads,
-        logger=None,
-        temp_audiofile_path=output_dir,
-        audio_codec="aac",
-        fps=30,
-    )
-    video_clip.close()
+        video_clip = concatenate_videoclips(clips)
+        logger.info("writing")
+        # https://github.com/harry0703/MoneyPrinterTurbo/issues/111#issuecomment-2032354030
+        video_clip.write_videofile(
+            filename=combined_video_path,
+            threads=threads,
+            logger=None,
+            temp_audiofile_path=output_dir,
+            codec=encoder,
+            **_moviepy_encoder_args(encoder),
+            audio_codec="aac",
+            # frames are sampled at 30fps whatever the sources' rates
+            fps=30,
+        )
+        video_clip.close()
+    finally:
+        for clip in source_clips.values():
+            clip.close()
     logger.success("completed")
     return combined_video_path
 
 
+def _probe_duration(file_path: str):
+    """Read the duration of a media file without decoding it.
+
+    Uses ffprobe when it is installed next to ffmpeg or on the PATH, else
+    the duration ffmpeg prints in its banner.
+
+    Returns:
+        float or None: The duration in seconds, None when it can't be read.
+    """
+
+    ffmpeg = _ffmpeg_exe()
+    ffprobe = os.path.join(
+        os.path.dirname(ffmpeg), "ffprobe.exe" if os.name == "nt" else "ffprobe"
+    )
+    if not os.path.isfile(ffprobe):
+        ffprobe = shutil.which("ffprobe")
+    if ffprobe:
+        try:
+            result = subprocess.run(
+                [
+                    ffprobe,
+                    "-v",
+                    "quiet",
+                    "-show_entries",
+                    "format=duration",
+                    "-of",
+                    "csv=p=0",
+                    file_path,
+                ],
+                capture_output=True,
+                text=True,
+                timeout=30,
+            )
+            return float(result.stdout.strip())
+        except Exception:
+            pass
+
+    try:
+        result = subprocess.run(
+            [ffmpeg, "-hide_banner", "-i", file_path],
+            capture_output=True,
+            text=True,
+            errors="replace",
+            timeout=30,
+        )
+    except Exception as e:
+        logger.warning(f"failed to probe duration: {file_path} => {str(e)}")
+        return None
+    duration = _DURATION_RE.search(result.stderr)
+    if not duration:
+        return None
+    hours, minutes, seconds = duration.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def _probe_video(video_path: str):
+    """Read the duration and the video codec of a file from ffmpeg's banner.
+
+    Returns:
+        tuple or None: (duration in seconds, codec name), None when the file
+            has no readable duration or video stream.
+    """
+
+    try:
+        result = subprocess.run(
+            [_ffmpeg_exe(), "-hide_banner", "-i", video_path],
+            capture_output=True,
+            text=True,
+            errors="replace",
+            timeout=30,
+        )
+    except Exception as e:
+        logger.warning(f"failed to probe video: {video_path} => {str(e)}")
+        return None
+
+    duration = _DURATION_RE.search(result.stderr)
+    codec = _VIDEO_CODEC_RE.search(result.stderr)
+    if not duration or not codec:
+        return None
+    hours, minutes, seconds = duration.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds), codec.group(1)
+
+
+def _ffmpeg_combine(
+    combined_video_path: str,
+    video_paths: List[str],
+    audio_duration: float,
+    video_width: int,
+    video_height: int,
+    video_concat_mode: VideoConcatMode,
+    max_clip_duration: int,
+    threads: int,
+    encoder: str,
+    max_workers: int = None,
+) -> bool:
+    """Cut, letterbox and concatenate the clips with ffmpeg.
+
+    Produces the same timeline as the moviepy path in combine_videos. Every
+    distinct segment is cut, scaled, padded and converted to 30fps by its
+    own ffmpeg process, several at a time, and the identically encoded
+    results are joined by the concat demuxer without re-encoding. Frames
+    never pass through python. Returns False when a source can't be probed
+    or ffmpeg fails, so the caller can fall back to moviepy.
+    """
+
+    # images are zoomed into clips of max_clip_duration while being prepared
+    probes = [
+        (max_clip_duration, "image") if _is_image(video_path) else _probe_video(video_path)
+        for video_path in video_paths
+    ]
+    if not probes or None in probes:
+        return False
+
+    segments = []
+    for video_path, (clip_duration, _) in zip(video_paths, probes):
+        start_time = 0
+        while start_time < clip_duration:
+            end_time = min(start_time + max_clip_duration, clip_duration)
+            segments.append((video_path, start_time, end_time))
+            start_time = end_time
+            if video_concat_mode.value == VideoConcatMode.sequential.value:
+                break
+    if not segments:
+        return False
+
+    if video_concat_mode.value == VideoConcatMode.random.value:
+        random.shuffle(segments)
+
+    # repeat the segments until the audio is covered, the last one is cut short
+    timeline = []
+    video_duration = 0
+    while video_duration < audio_duration:
+        for video_path, start_time, end_time in segments:
+            length = min(end_time - start_time, audio_duration - video_duration)
+            if length <= 0:
+                break
+            timeline.append((video_path, start_time, start_time + length))
+            video_duration += length
+
+    segments_dir = f"{combined_video_path}.segments"
+    os.makedirs(segments_dir, exist_ok=True)
+    try:
+        # repeated segments are prepared once and listed again in the concat
+        prepared = {segment: None for segment in timeline}
+        for idx, segment in enumerate(prepared):
+            prepared[segment] = os.path.join(segments_dir, f"{idx}.mp4")
+
+        # each ffmpeg encodes with `threads` threads, hardware encoders
+        # only allow a few concurrent sessions
+        cpu_count = os.cpu_count() or 2
+        if not max_workers:
+            max_workers = max(1, cpu_count // max(threads, 1))
+        # 0 leaves the thread count to ffmpeg, which would take every core in
+        # every process, split them between the workers instead
+        threads = threads or max(1, cpu_count // max_workers)
+        if encoder in _HWACCEL_ENCODERS:
+            max_workers = min(max_workers, 2)
+        logger.info(
+            f"preparing {len(prepared)} segments with {max_workers} ffmpeg workers"
+        )
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(
+                lambda item: _prep_segment(
+                    *item[0],
+                    video_width,
+                    video_height,
+                    item[1],
+                    encoder,
+                    threads,
+                    max_clip_duration,
+                ),
+                prepared.items(),
+            )
+            if not all(results):
+                return False
+
+        concat_file = os.path.join(segments_dir, "concat.txt")
+        with open(concat_file, "w", encoding="utf-8") as f:
+            f.write("ffconcat version 1.0\n")
+            for segment in timeline:
+                f.write(f"file '{os.path.basename(prepared[segment])}'\n")
+
+        cmd = [
+            _ffmpeg_exe(),
+            "-y",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-f",
+            "concat",
+            "-safe",
+            "0",
+            "-i",
+            concat_file,
+            "-c",
+            "copy",
+            "-movflags",
+            "+faststart",
+            combined_video_path,
+        ]
+        result = subprocess.run(cmd, capture_output=True, text=True, errors="replace")
+        if result.returncode != 0:
+            logger.warning(f"ffmpeg concat failed, fallback to moviepy: {result.stderr}")
+            return False
+        return True
+    finally:
+        shutil.rmtree(segments_dir, ignore_errors=True)
+
+
+def _prep_segment(
+    video_path: str,
+    start_time: float,
+    end_time: float,
+    video_width: int,
+    video_height: int,
+    output_file: str,
+    encoder: str,
+    threads: int,
+    zoom_duration: int,
+) -> bool:
+    vf = (
+        f"scale={video_width}:{video_height}:force_original_aspect_ratio=decrease,"
+        f"pad={video_width}:{video_height}:(ow-iw)/2:(oh-ih)/2:color=black,"
+        f"setsar=1,fps=30"
+    )
+    cmd = [_ffmpeg_exe(), "-y", "-hide_banner", "-loglevel", "error"]
+    if _is_image(video_path):
+        try:
+            with Image.open(video_path) as image:
+                image_width, image_height = image.size
+        except Exception as e:
+            logger.warning(f"failed to read image: {video_path} => {str(e)}")
+            return False
+        vf = f"{_zoom_filter(image_width, image_height, zoom_duration)},{vf}"
+        cmd += ["-loop", "1", "-i", video_path, "-t", f"{end_time - start_time:.3f}"]
+    else:
+        cmd += ["-ss", f"{start_time:.3f}", "-to", f"{end_time:.3f}", "-i", video_path]
+    cmd += [
+        "-vf",
+        vf,
+        "-an",
+        "-c:v",
+        encoder,
+        *_encoder_params(encoder),
+        "-pix_fmt",
+        "yuv420p",
+        "-threads",
+        str(threads),
+        output_file,
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True, errors="replace")
+    if result.returncode != 0:
+        logger.warning(f"failed to prepare segment of {video_path}: {result.stderr}")
+        return False
+    return True
+
+
+@functools.lru_cache(maxsize=32)
+def _get_font(font_path, fontsize):
+    return ImageFont.truetype(font_path, fontsize)
+
+
+# generated scripts repeat lines, a repeated line isn't measured again
+@functools.lru_cache(maxsize=1024)
 def wrap_text(text, max_width, font="Arial", fontsize=60):
     """Wrap text to fit within a specified width.
 
@@ -210,7 +644,7 @@ def wrap_text(text, max_width, font="Arial", fontsize=60):
     """
 
     # 创建字体对象
-    font = ImageFont.truetype(font, fontsize)
+    font = _get_font(font, fontsize)
 
     def get_text_size(inner_text):
         """Get the size of the given text.
@@ -239,21 +673,30 @@ def wrap_text(text, max_width, font="Arial", fontsize=60):
 
     processed = True
 
+    # line widths are running sums of per character advances, instead of
+    # measuring the whole line again after every word
+    advances = {ch: font.getlength(ch) for ch in set(text)}
+    space_width = font.getlength(" ")
+
     _wrapped_lines_ = []
     words = text.split(" ")
     _txt_ = ""
+    _txt_width = 0
     for word in words:
-        _before = _txt_
-        _txt_ += f"{word} "
-        _width, _height = get_text_size(_txt_)
-        if _width <= max_width:
-            continue
-        else:
-            if _txt_.strip() == word.strip():
+        word_width = sum(advances[ch] for ch in word)
+        if not _txt_:
+            if word_width > max_width:
                 processed = False
                 break
-            _wrapped_lines_.append(_before)
-            _txt_ = f"{word} "
+            _txt_, _txt_width = word, word_width
+            continue
+        _width = _txt_width + space_width + word_width
+        if _width <= max_width:
+            _txt_ = f"{_txt_} {word}"
+            _txt_width = _width
+        else:
+            _wrapped_lines_.append(_txt_)
+            _txt_, _txt_width = word, word_width
     _wrapped_lines_.append(_txt_)
     if processed:
         _wrapped_lines_ = [line.strip() for line in _wrapped_lines_]
@@ -262,30 +705,73 @@ def wrap_text(text, max_width, font="Arial", fontsize=60):
         # logger.warning(f"wrapped text: {result}")
         return result, height
 
+    # words wider than a line, break between any two characters instead
     _wrapped_lines_ = []
-    chars = list(text)
-    _txt_ = ""
-    for word in chars:
-        _txt_ += word
-        _width, _height = get_text_size(_txt_)
-        if _width <= max_width:
-            continue
+    _txt_ = []
+    _txt_width = 0
+    for ch in text:
+        ch_width = advances[ch]
+        if _txt_ and _txt_width + ch_width > max_width:
+            _wrapped_lines_.append("".join(_txt_))
+            _txt_, _txt_width = [ch], ch_width
         else:
-            _wrapped_lines_.append(_txt_)
-            _txt_ = ""
-    _wrapped_lines_.append(_txt_)
+            _txt_.append(ch)
+            _txt_width += ch_width
+    _wrapped_lines_.append("".join(_txt_))
     result = "\n".join(_wrapped_lines_).strip()
     height = len(_wrapped_lines_) * height
     # logger.warning(f"wrapped text: {result}")
     return result, height
 
 
+def _render_text_clip(
+    text: str,
+    font_path: str,
+    font_size: int,
+    color: str,
+    bg_color: str,
+    stroke_color: str,
+    stroke_width: float,
+) -> ImageClip:
+    """Render a subtitle with PIL into a transparent ImageClip.
+
+    Stands in for TextClip, which starts an ImageMagick process and writes
+    a temporary PNG for every subtitle line. Lines are centered like
+    TextClip's default alignment.
+    """
+
+    font = _get_font(font_path, font_size)
+    stroke = int(round(stroke_width or 0))
+    measure = ImageDraw.Draw(Image.new("RGBA", (1, 1)))
+    left, top, right, bottom = measure.multiline_textbbox(
+        (0, 0), text, font=font, stroke_width=stroke, align="center"
+    )
+
+    background = (bg_color or "").strip().lower()
+    if background in ("", "transparent", "none"):
+        fill = (0, 0, 0, 0)
+    else:
+        fill = (*ImageColor.getrgb(bg_color)[:3], 255)
+    image = Image.new("RGBA", (max(right - left, 1), max(bottom - top, 1)), fill)
+    ImageDraw.Draw(image).multiline_text(
+        (-left, -top),
+        text,
+        font=font,
+        fill=color,
+        align="center",
+        stroke_width=stroke,
+        stroke_fill=stroke_color,
+    )
+    return ImageClip(np.array(image), transparent=True)
+
+
 def generate_video(
     video_path: str,
     audio_path: str,
     subtitle_path: str,
     output_file: str,
     params: VideoParams,
+    encoder: str = None,
 ):
     """Generate a video by combining video, audio, and subtitles.
 
@@ -302,6 +788,7 @@ def generate_video(
         output_file (str): The path where the output video file will be saved.
         params (VideoParams): An object containing various parameters for video generation, such as
             aspect ratio, font settings, volume levels, and subtitle options.
+        encoder (str?): The ffmpeg video encoder. Defaults to the one picked by detect_hwaccel.
     """
 
     aspect = VideoAspect(params.video_aspect)
@@ -328,6 +815,30 @@ def generate_video(
 
         logger.info(f"using font: {font_path}")
 
+    encoder = encoder or detect_hwaccel()
+    bgm_file = get_bgm_file(bgm_type=params.bgm_type, bgm_file=params.bgm_file)
+    if _ffmpeg_generate(
+        video_path=video_path,
+        audio_path=audio_path,
+        subtitle_path=subtitle_path,
+        bgm_file=bgm_file,
+        output_file=output_file,
+        params=params,
+        font_path=font_path,
+        video_width=video_width,
+        video_height=video_height,
+        encoder=encoder,
+    ):
+        logger.success("completed")
+        return
+
+    # the same for every subtitle line
+    max_width = video_width * 0.9
+    bottom_y = video_height * 0.95
+    top_y = video_height * 0.05
+    margin = 10  # 额外的边距，单位为像素
+    custom_ratio = params.custom_position / 100
+
     def create_text_clip(subtitle_item):
         """Create a text clip for subtitles in a video.
 
@@ -345,39 +856,36 @@ def generate_video(
                 - A string representing the subtitle text.
 
         Returns:
-            TextClip: A moviepy TextClip object configured with the wrapped text and specified
+            ImageClip: A moviepy ImageClip object rendered with the wrapped text and specified
                 properties.
         """
 
         phrase = subtitle_item[1]
-        max_width = video_width * 0.9
         wrapped_txt, txt_height = wrap_text(
             phrase, max_width=max_width, font=font_path, fontsize=params.font_size
         )
-        _clip = TextClip(
+        _clip = _render_text_clip(
             wrapped_txt,
-            font=font_path,
-            fontsize=params.font_size,
+            font_path=font_path,
+            font_size=params.font_size,
             color=params.text_fore_color,
             bg_color=params.text_background_color,
             stroke_color=params.stroke_color,
             stroke_width=params.stroke_width,
-            print_cmd=False,
         )
         duration = subtitle_item[0][1] - subtitle_item[0][0]
         _clip = _clip.set_start(subtitle_item[0][0])
         _clip = _clip.set_end(subtitle_item[0][1])
         _clip = _clip.set_duration(duration)
         if params.subtitle_position == "bottom":
-            _clip = _clip.set_position(("center", video_height * 0.95 - _clip.h))
+            _clip = _clip.set_position(("center", bottom_y - _clip.h))
         elif params.subtitle_position == "top":
-            _clip = _clip.set_position(("center", video_height * 0.05))
+            _clip = _clip.set_position(("center", top_y))
         elif params.subtitle_position == "custom":
             # 确保字幕完全在屏幕内
-            margin = 10  # 额外的边距，单位为像素
             max_y = video_height - _clip.h - margin
             min_y = margin
-            custom_y = (video_height - _clip.h) * (params.custom_position / 100)
+            custom_y = (video_height - _clip.h) * custom_ratio
             custom_y = max(min_y, min(custom_y, max_y))  # 限制 y 值在有效范围内
             _clip = _clip.set_position(("center", custom_y))
         else:  # center
@@ -388,14 +896,12 @@ def generate_video(
     audio_clip = AudioFileClip(audio_path).volumex(params.voice_volume)
 
     if subtitle_path and os.path.exists(subtitle_path):
-        sub = SubtitlesClip(subtitles=subtitle_path, encoding="utf-8")
         text_clips = []
-        for item in sub.subtitles:
+        for item in _load_subtitles(subtitle_path):
             clip = create_text_clip(subtitle_item=item)
             text_clips.append(clip)
         video_clip = CompositeVideoClip([video_clip, *text_clips])
 
-    bgm_file = get_bgm_file(bgm_type=params.bgm_type, bgm_file=params.bgm_file)
     if bgm_file:
         try:
             bgm_clip = (
@@ -409,9 +915,12 @@ def generate_video(
     video_clip = video_clip.set_audio(audio_clip)
     video_clip.write_videofile(
         output_file,
+        codec=encoder,
+        **_moviepy_encoder_args(encoder),
         audio_codec="aac",
         temp_audiofile_path=output_dir,
-        threads=params.n_threads or 2,
+        # 0 lets the encoder use every core
+        threads=params.n_threads or 0,
         logger=None,
         fps=30,
     )
@@ -420,6 +929,216 @@ def generate_video(
     logger.success("completed")
 
 
+def _load_subtitles(subtitle_path: str):
+    """Parse an srt file into ((start, end), text) items, times in seconds.
+
+    Returns the same items as moviepy's file_to_subtitles with one regex
+    pass over the file.
+    """
+
+    with open(subtitle_path, "r", encoding="utf-8") as f:
+        content = f.read().replace("\r\n", "\n")
+
+    items = []
+    for match in _SRT_CUE_RE.finditer(content):
+        h1, m1, s1, ms1, h2, m2, s2, ms2 = map(int, match.groups()[:8])
+        start_time = h1 * 3600 + m1 * 60 + s1 + ms1 / 1000
+        end_time = h2 * 3600 + m2 * 60 + s2 + ms2 / 1000
+        items.append(((start_time, end_time), match.group(9).strip()))
+    return items
+
+
+@functools.lru_cache(maxsize=None)
+def _ffmpeg_has_filter(name: str) -> bool:
+    try:
+        result = subprocess.run(
+            [_ffmpeg_exe(), "-hide_banner", "-filters"],
+            capture_output=True,
+            text=True,
+            timeout=10,
+        )
+    except Exception:
+        return False
+    return re.search(rf"^\s*\S+\s+{re.escape(name)}\s", result.stdout, re.M) is not None
+
+
+def _ass_color(color: str) -> str:
+    # libass colours are &HAABBGGRR
+    r, g, b = ImageColor.getrgb(color)[:3]
+    return f"&H00{b:02X}{g:02X}{r:02X}"
+
+
+def _filter_path(file_path: str) -> str:
+    # quoted filter option, the colon of windows drive letters still needs escaping
+    return "'" + file_path.replace("\\", "/").replace(":", "\\:") + "'"
+
+
+def _ffmpeg_generate(
+    video_path: str,
+    audio_path: str,
+    subtitle_path: str,
+    bgm_file: str,
+    output_file: str,
+    params: VideoParams,
+    font_path: str,
+    video_width: int,
+    video_height: int,
+    encoder: str,
+) -> bool:
+    """Mux the narration and burn in the subtitles with a single ffmpeg run.
+
+    The subtitles are rendered by libass in ffmpeg's filter graph instead of
+    one text clip per line composited frame by frame in python. Lines are
+    still wrapped with wrap_text, so they break where the moviepy path
+    breaks them. Without subtitles the video stream is copied as is. The
+    background music is looped, faded out and mixed under the narration by
+    amix rather than CompositeAudioClip.
+
+    Returns False, without writing the output, for the styles libass can't
+    reproduce (a background box), when ffmpeg lacks the subtitles filter or
+    when ffmpeg fails, so the caller can fall back to moviepy.
+    """
+
+    burn_subtitles = bool(subtitle_path and os.path.exists(subtitle_path))
+    if burn_subtitles:
+        background = (params.text_background_color or "").strip().lower()
+        if background not in ("", "transparent", "none"):
+            return False
+        if "'" in subtitle_path or "'" in font_path:
+            return False
+        if not _ffmpeg_has_filter("subtitles"):
+            return False
+
+    cmd = [
+        _ffmpeg_exe(),
+        "-y",
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-i",
+        video_path,
+        "-i",
+        audio_path,
+    ]
+
+    audio_filter = f"[1:a]volume={params.voice_volume}[aout]"
+    if bgm_file:
+        probe = _probe_video(video_path)
+        if probe is None:
+            return False
+        fade_start = max(probe[0] - 3, 0)
+        cmd += ["-stream_loop", "-1", "-i", bgm_file]
+        # amix would halve both inputs, the moviepy path sums them
+        audio_filter = (
+            f"[2:a]volume={params.bgm_volume},afade=t=out:st={fade_start:.3f}:d=3[bgm];"
+            f"[1:a]volume={params.voice_volume}[vo];"
+            f"[vo][bgm]amix=inputs=2:duration=first:normalize=0[aout]"
+        )
+    cmd += [
+        "-filter_complex",
+        audio_filter,
+        "-map",
+        "0:v:0",
+        "-map",
+        "[aout]",
+    ]
+
+    wrapped_subtitle_path = ""
+    if burn_subtitles:
+        try:
+            font_name = _get_font(font_path, params.font_size).getname()[0]
+        except Exception as e:
+            logger.warning(f"failed to load font for libass: {str(e)}")
+            return False
+
+        # pre-wrap the lines to the same width as the moviepy path
+        wrapped_subtitle_path = f"{output_file}.wrapped.srt"
+        lines = []
+        line_count = 1
+        for idx, ((start_time, end_time), text) in enumerate(
+            _load_subtitles(subtitle_path), start=1
+        ):
+            wrapped_txt, _ = wrap_text(
+                text,
+                max_width=video_width * 0.9,
+                font=font_path,
+                fontsize=params.font_size,
+            )
+            line_count = max(line_count, wrapped_txt.count("\n") + 1)
+            lines.append(utils.text_to_srt(idx, wrapped_txt, start_time, end_time))
+        try:
+            style = _ass_style(params, font_name, video_height, line_count)
+        except ValueError as e:
+            logger.warning(f"invalid subtitle colors for libass: {str(e)}")
+            return False
+        with open(wrapped_subtitle_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+        vf = (
+            f"subtitles=filename={_filter_path(wrapped_subtitle_path)}"
+            f":fontsdir={_filter_path(utils.font_dir())}"
+            f":force_style='{style}'"
+        )
+        cmd += ["-vf", vf, "-c:v", encoder, *_encoder_params(encoder)]
+        cmd += ["-pix_fmt", "yuv420p", "-threads", str(params.n_threads or 0)]
+    else:
+        cmd += ["-c:v", "copy", "-movflags", "+faststart"]
+
+    cmd += [
+        "-c:a",
+        "aac",
+        "-shortest",
+        output_file,
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, errors="replace")
+    finally:
+        if wrapped_subtitle_path and os.path.exists(wrapped_subtitle_path):
+            os.remove(wrapped_subtitle_path)
+    if result.returncode != 0:
+        logger.warning(f"ffmpeg generate failed, fallback to moviepy: {result.stderr}")
+        return False
+    return True
+
+
+def _ass_style(
+    params: VideoParams, font_name: str, video_height: int, line_count: int = 1
+) -> str:
+    # srt subtitles are laid out on a 288 pixel high canvas that libass scales
+    # to the video, sizes and margins given in video pixels are scaled down
+    scale = 288 / video_height
+    margin_v = 0
+    alignment = 5
+    if params.subtitle_position == "bottom":
+        alignment, margin_v = 2, 288 * 0.05
+    elif params.subtitle_position == "top":
+        alignment, margin_v = 8, 288 * 0.05
+    elif params.subtitle_position == "custom":
+        # bottom anchored. the moviepy path puts the top edge at
+        # (height - text height) * ratio, which leaves the same share of the
+        # free space below the text. the text block is estimated from the
+        # tallest cue, one font size per line
+        alignment = 2
+        text_height = params.font_size * line_count
+        margin_v = (video_height - text_height) * (100 - params.custom_position) / 100
+        margin_v = max(10, min(margin_v, video_height - text_height - 10)) * scale
+
+    style = {
+        "FontName": font_name,
+        "FontSize": round(params.font_size * scale, 2),
+        "PrimaryColour": _ass_color(params.text_fore_color),
+        "OutlineColour": _ass_color(params.stroke_color),
+        "BorderStyle": 1,
+        "Outline": round(params.stroke_width * scale, 2),
+        "Shadow": 0,
+        "Alignment": alignment,
+        "MarginV": round(margin_v),
+        # the lines are pre-wrapped, only break at their newlines
+        "WrapStyle": 2,
+    }
+    return ",".join(f"{k}={v}" for k, v in style.items())
+
+
 def preprocess_video(materials: List[MaterialInfo], clip_duration=4):
     """Preprocess a list of video and image materials.
 
@@ -427,18 +1146,18 @@ def preprocess_video(materials: List[MaterialInfo], clip_duration=4):
     material's URL. If the URL is valid, it attempts to create a video clip
     from the URL. If the creation fails, it tries to create an image clip
     instead. The function checks the dimensions of the clip and logs a
-    warning if the dimensions are smaller than 480 pixels. For image
-    materials, it creates a zoom effect and outputs the processed video as
-    an MP4 file. The processed materials are updated with the new video
-    URLs.
+    warning if the dimensions are smaller than 480 pixels. Image materials
+    are kept as they are, combine_videos renders their zoom effect while
+    it cuts the other clips, so no intermediate MP4 is written per image.
 
     Args:
         materials (List[MaterialInfo]): A list of MaterialInfo objects containing URLs
             to video or image files.
         clip_duration (int?): The duration of the clips in seconds. Defaults to 4.
+            Unused, the image clips take combine_videos' max_clip_duration.
 
     Returns:
-        List[MaterialInfo]: The updated list of materials with new video URLs.
+        List[MaterialInfo]: The materials.
     """
 
     for material in materials:
@@ -458,35 +1177,36 @@ def preprocess_video(materials: List[MaterialInfo], clip_duration=4):
             continue
 
         if ext in const.FILE_TYPE_IMAGES:
-            logger.info(f"processing image: {material.url}")
-            # 创建一个图片剪辑，并设置持续时间为3秒钟
-            clip = (
-                ImageClip(material.url)
-                .set_duration(clip_duration)
-                .set_position("center")
-            )
-            # 使用resize方法来添加缩放效果。这里使用了lambda函数来使得缩放效果随时间变化。
-            # 假设我们想要从原始大小逐渐放大到120%的大小。
-            # t代表当前时间，clip.duration为视频总时长，这里是3秒。
-            # 注意：1 表示100%的大小，所以1.2表示120%的大小
-            zoom_clip = clip.resize(
-                lambda t: 1 + (clip_duration * 0.03) * (t / clip.duration)
-            )
-
-            # 如果需要，可以创建一个包含缩放剪辑的复合视频剪辑
-            # （这在您想要在视频中添加其他元素时非常有用）
-            final_clip = CompositeVideoClip([zoom_clip])
-
-            # 输出视频
-            video_file = f"{material.url}.mp4"
-            final_clip.write_videofile(video_file, fps=30, logger=None)
-            final_clip.close()
-            del final_clip
-            material.url = video_file
-            logger.success(f"completed: {video_file}")
+            # the zoom is rendered while combining, see _prep_segment
+            logger.info(f"using image: {material.url}")
     return materials
 
 
+def _is_image(file_path: str) -> bool:
+    return utils.parse_extension(file_path) in const.FILE_TYPE_IMAGES
+
+
+def _zoom_filter(width: int, height: int, clip_duration: int) -> str:
+    # grows the image by 3% per second around its center, at 30fps.
+    # yuv420p needs even dimensions
+    frames = clip_duration * 30
+    width, height = width - width % 2, height - height % 2
+    return (
+        f"zoompan=z='1+{clip_duration * 0.03}*on/{frames}'"
+        f":x='iw/2-(iw/zoom/2)':y='ih/2-(ih/zoom/2)'"
+        f":d={frames}:s={width}x{height}:fps=30"
+    )
+
+
+def _zoom_image_clip(image_file: str, clip_duration: int):
+    # 创建一个图片剪辑，并设置持续时间
+    clip = ImageClip(image_file).set_duration(clip_duration).set_position("center")
+    # 使用resize方法来添加缩放效果。这里使用了lambda函数来使得缩放效果随时间变化。
+    # 注意：1 表示100%的大小，所以1.2表示120%的大小
+    zoom_clip = clip.resize(lambda t: 1 + (clip_duration * 0.03) * (t / clip.duration))
+    return CompositeVideoClip([zoom_clip]).set_fps(30)
+
+
 if __name__ == "__main__":
     m = MaterialInfo()
     m.url = "/Users/harry/Downloads/IMG_2915.JPG"
@@ -7,11 +7,14 @@ from edge_tts.submaker import mktimestamp
 from loguru import logger
 from edge_tts import submaker, SubMaker
 import edge_tts
-from moviepy.video.tools import subtitles
 
 from app.config import config
 from app.utils import utils
 
+_edge_tts_concurrency = int(config.app.get("edge_tts_concurrency", 4))
+# edge tts streams 24khz 48kbit/s mono mp3
+_EDGE_MP3_BYTES_PER_SECOND = 48000 // 8
+
 
 def get_all_azure_voices(filter_locals=None) -> list[str]:
     if filter_locals is None:
@@ -1056,20 +1059,9 @@ def azure_tts_v1(
         try:
             logger.info(f"start, voice name: {voice_name}, try: {i + 1}")
 
-            async def _do() -> SubMaker:
-                communicate = edge_tts.Communicate(text, voice_name, rate=rate_str)
-                sub_maker = edge_tts.SubMaker()
-                with open(voice_file, "wb") as file:
-                    async for chunk in communicate.stream():
-                        if chunk["type"] == "audio":
-                            file.write(chunk["data"])
-                        elif chunk["type"] == "WordBoundary":
-                            sub_maker.create_sub(
-                                (chunk["offset"], chunk["duration"]), chunk["text"]
-                            )
-                return sub_maker
-
-            sub_maker = asyncio.run(_do())
+            sub_maker = asyncio.run(
+                _edge_tts(_split_sentences(text), voice_name, rate_str, voice_file)
+            )
             if not sub_maker or not sub_maker.subs:
                 logger.warning(f"failed, sub_maker is None or sub_maker.subs is None")
                 continue
@@ -1081,6 +1073,48 @@ def azure_tts_v1(
     return None
 
 
+async def _edge_tts(
+    segments: list[str], voice_name: str, rate_str: str, voice_file: str
+) -> SubMaker:
+    """
+    synthesize the segments concurrently, then write the mp3 frames in order
+    and shift each segment's word boundaries by the audio written before it
+    """
+    sem = asyncio.Semaphore(_edge_tts_concurrency)
+
+    async def _synthesize(segment: str):
+        audio = bytearray()
+        boundaries = []
+        async with sem:
+            communicate = edge_tts.Communicate(segment, voice_name, rate=rate_str)
+            async for chunk in communicate.stream():
+                if chunk["type"] == "audio":
+                    audio += chunk["data"]
+                elif chunk["type"] == "WordBoundary":
+                    boundaries.append(
+                        (chunk["offset"], chunk["duration"], chunk["text"])
+                    )
+        return audio, boundaries
+
+    results = await asyncio.gather(*(_synthesize(s) for s in segments))
+
+    sub_maker = edge_tts.SubMaker()
+    offset = 0
+    with open(voice_file, "wb") as file:
+        for audio, boundaries in results:
+            file.write(audio)
+            for start, duration, word in boundaries:
+                sub_maker.create_sub((offset + start, duration), word)
+            # constant bitrate, the byte count gives the segment duration
+            offset += len(audio) * 10000000 // _EDGE_MP3_BYTES_PER_SECOND
+    return sub_maker
+
+
+def _split_sentences(text: str) -> list[str]:
+    # sentences are synthesized as separate concurrent edge tts requests
+    return utils.split_sentences(text) or [text]
+
+
 def azure_tts_v2(text: str, voice_name: str, voice_file: str) -> [SubMaker, None]:
     voice_name = is_azure_v2_voice(voice_name)
     if not voice_name:
@@ -1184,12 +1218,16 @@ def _format_text(text: str) -> str:
     return text
 
 
-def create_subtitle(sub_maker: submaker.SubMaker, text: str, subtitle_file: str):
+def create_subtitle(
+    sub_maker: submaker.SubMaker, text: str, subtitle_file: str
+) -> str:
     """
     优化字幕文件
     1. 将字幕文件按照标点符号分割成多行
     2. 逐行匹配字幕文件中的文本
     3. 生成新的字幕文件
+
+    returns the srt content written to subtitle_file, or "" on failure
     """
 
     text = _format_text(text)
@@ -1253,18 +1291,17 @@ def create_subtitle(sub_maker: submaker.SubMaker, text: str, subtitle_file: str)
                 start_time = -1.0
                 sub_line = ""
 
-        if len(sub_items) == len(script_lines):
+        # no cues is a failure too, the callers fall back to whisper on ""
+        if sub_items and len(sub_items) == len(script_lines):
+            srt = "\n".join(sub_items) + "\n"
             with open(subtitle_file, "w", encoding="utf-8") as file:
-                file.write("\n".join(sub_items) + "\n")
-            try:
-                sbs = subtitles.file_to_subtitles(subtitle_file, encoding="utf-8")
-                duration = max([tb for ((ta, tb), txt) in sbs])
-                logger.info(
-                    f"completed, subtitle file created: {subtitle_file}, duration: {duration}"
-                )
-            except Exception as e:
-                logger.error(f"failed, error: {str(e)}")
-                os.remove(subtitle_file)
+                file.write(srt)
+            # the items are in order, the last one ends the subtitle
+            duration = end_time / 10000000
+            logger.info(
+                f"completed, subtitle file created: {subtitle_file}, duration: {duration}"
+            )
+            return srt
         else:
             logger.warning(
                 f"failed, sub_items len: {len(sub_items)}, script_lines len: {len(script_lines)}"
@@ -1272,6 +1309,7 @@ def create_subtitle(sub_maker: submaker.SubMaker, text: str, subtitle_file: str)
 
     except Exception as e:
         logger.error(f"failed, error: {str(e)}")
+    return ""
 
 
 def get_audio_duration(sub_maker: submaker.SubMaker):
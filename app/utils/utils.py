@@ -1,6 +1,8 @@
+import functools
 import locale
 import os
 import platform
+import re
 import threading
 from typing import Any
 from loguru import logger
@@ -12,6 +14,12 @@ from app.models import const
 
 urllib3.disable_warnings()
 
+# a run of terminators ends a sentence. latin ones only when whitespace
+# follows, so 3.5 and U.S.A stay whole, cjk ones need none
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?])\s+|(?<=[。！？])(?![。！？])\s*")
+# a sentence is not ended by a title or a dotted abbreviation like e.g. or U.S.
+_ABBREVIATION_RE = re.compile(r"(?:\b(?:Mr|Mrs|Ms|Dr|Prof|St|vs)|\b(?:[A-Za-z]\.)+[A-Za-z])\.$")
+
 
 def get_response(status: int, data: Any = None, message: str = ""):
     obj = {
@@ -84,12 +92,19 @@ def resource_dir(sub_dir: str = ""):
     return d
 
 
+@functools.lru_cache(maxsize=1)
+def _tasks_root():
+    # only the path is memoized, realpath resolves symlinks on every call and
+    # the root never changes. task_dir still creates the directories
+    return os.path.join(storage_dir(), "tasks")
+
+
 def task_dir(sub_dir: str = ""):
-    d = os.path.join(storage_dir(), "tasks")
+    d = _tasks_root()
     if sub_dir:
         d = os.path.join(d, sub_dir)
-    if not os.path.exists(d):
-        os.makedirs(d)
+    # not cached, a task directory may be removed by cleanup outside this process
+    os.makedirs(d, exist_ok=True)
     return d
 
 
@@ -111,12 +126,17 @@ def song_dir(sub_dir: str = ""):
     return d
 
 
+@functools.lru_cache(maxsize=1)
+def _public_root():
+    # memoized like _tasks_root, public_dir creates the directories
+    return resource_dir("public")
+
+
 def public_dir(sub_dir: str = ""):
-    d = resource_dir(f"public")
+    d = _public_root()
     if sub_dir:
         d = os.path.join(d, sub_dir)
-    if not os.path.exists(d):
-        os.makedirs(d)
+    os.makedirs(d, exist_ok=True)
     return d
 
 
@@ -197,6 +217,32 @@ def split_string_by_punctuations(s):
     return result
 
 
+def split_sentences(text: str) -> list[str]:
+    """Split a script into sentences.
+
+    Pieces without any letter or digit, like a stray quote or ellipsis, are
+    merged into the sentence before them, tts services return no audio for
+    text that is only punctuation. So are the pieces after an abbreviation.
+    """
+
+    def has_words(segment):
+        return any(ch.isalnum() for ch in segment)
+
+    sentences = []
+    for segment in _SENTENCE_SPLIT_RE.split(text):
+        segment = segment.strip()
+        if not segment:
+            continue
+        if sentences and (
+            not (has_words(segment) and has_words(sentences[-1]))
+            or _ABBREVIATION_RE.search(sentences[-1])
+        ):
+            sentences[-1] = f"{sentences[-1]} {segment}"
+        else:
+            sentences.append(segment)
+    return sentences
+
+
 def md5(text):
     import hashlib
 
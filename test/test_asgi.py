@@ -0,0 +1,188 @@
+import asyncio
+import gzip
+import os
+import tempfile
+import unittest
+
+from fastapi import FastAPI
+
+from app.asgi import (
+    CachingStaticFiles,
+    SelectiveGZipMiddleware,
+    SimpleCORSMiddleware,
+    StaticCacheMiddleware,
+    load_static_cache,
+    prioritize_routes,
+)
+
+
+def call(app, path="/", method="GET", headers=()):
+    scope = {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(k.encode(), v.encode()) for k, v in headers],
+    }
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    start = messages[0]
+    body = b"".join(m.get("body", b"") for m in messages[1:])
+    return start["status"], dict(start["headers"]), body
+
+
+class TestCachingStaticFiles(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        with open(os.path.join(tmp.name, "final-1.mp4"), "wb") as f:
+            f.write(b"\x00" * 64)
+        self.app = CachingStaticFiles(directory=tmp.name, max_age=60)
+
+    def test_responses_carry_cache_control(self):
+        status, headers, body = call(self.app, path="/final-1.mp4")
+        self.assertEqual(status, 200)
+        self.assertEqual(body, b"\x00" * 64)
+        self.assertEqual(headers[b"cache-control"], b"public, max-age=60")
+        self.assertIn(b"etag", headers)
+
+        status, headers, body = call(
+            self.app,
+            path="/final-1.mp4",
+            headers=[("if-none-match", headers[b"etag"].decode())],
+        )
+        self.assertEqual(status, 304)
+        self.assertEqual(body, b"")
+        self.assertEqual(headers[b"cache-control"], b"public, max-age=60")
+
+
+async def plain_app(scope, receive, send):
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/plain")],
+        }
+    )
+    await send({"type": "http.response.body", "body": b"x" * 1000})
+
+
+class TestSimpleCORSMiddleware(unittest.TestCase):
+    def test_wildcard_origin(self):
+        app = SimpleCORSMiddleware(plain_app)
+        _, headers, _ = call(app, headers=[("origin", "https://a.example")])
+        self.assertEqual(headers[b"access-control-allow-origin"], b"*")
+        self.assertNotIn(b"access-control-allow-credentials", headers)
+
+    def test_listed_origin_is_echoed_with_credentials(self):
+        app = SimpleCORSMiddleware(
+            plain_app, allow_origins=("https://a.example",), allow_credentials=True
+        )
+        _, headers, _ = call(app, headers=[("origin", "https://a.example")])
+        self.assertEqual(headers[b"access-control-allow-origin"], b"https://a.example")
+        self.assertEqual(headers[b"access-control-allow-credentials"], b"true")
+        self.assertEqual(headers[b"vary"], b"Origin")
+
+        _, headers, _ = call(app, headers=[("origin", "https://b.example")])
+        self.assertNotIn(b"access-control-allow-origin", headers)
+
+    def test_preflight_is_answered_directly(self):
+        app = SimpleCORSMiddleware(plain_app, allow_origins=("https://a.example",))
+        status, headers, _ = call(
+            app,
+            method="OPTIONS",
+            headers=[
+                ("origin", "https://a.example"),
+                ("access-control-request-method", "DELETE"),
+                ("access-control-request-headers", "x-token"),
+            ],
+        )
+        self.assertEqual(status, 200)
+        self.assertIn(b"DELETE", headers[b"access-control-allow-methods"])
+        self.assertEqual(headers[b"access-control-allow-headers"], b"x-token")
+
+        status, _, _ = call(
+            app,
+            method="OPTIONS",
+            headers=[
+                ("origin", "https://b.example"),
+                ("access-control-request-method", "GET"),
+            ],
+        )
+        self.assertEqual(status, 400)
+
+
+class TestSelectiveGZipMiddleware(unittest.TestCase):
+    def test_excluded_prefixes_are_not_compressed(self):
+        app = SelectiveGZipMiddleware(plain_app, exclude_prefixes=("/tasks",))
+        accept = [("accept-encoding", "gzip")]
+
+        _, headers, body = call(app, path="/api/v1/musics", headers=accept)
+        self.assertEqual(headers[b"content-encoding"], b"gzip")
+        self.assertEqual(gzip.decompress(body), b"x" * 1000)
+
+        _, headers, body = call(app, path="/tasks/1/final-1.mp4", headers=accept)
+        self.assertNotIn(b"content-encoding", headers)
+        self.assertEqual(body, b"x" * 1000)
+
+
+class TestStaticCacheMiddleware(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        with open(os.path.join(tmp.name, "index.html"), "w") as f:
+            f.write("<html>" + "x" * 1000 + "</html>")
+        self.app = StaticCacheMiddleware(plain_app, load_static_cache(tmp.name))
+
+    def test_index_is_served_from_memory(self):
+        status, headers, body = call(self.app, path="/")
+        self.assertEqual(status, 200)
+        self.assertTrue(body.startswith(b"<html>"))
+        self.assertEqual(headers[b"content-length"], str(len(body)).encode())
+
+        _, headers, body = call(
+            self.app, path="/index.html", headers=[("accept-encoding", "gzip")]
+        )
+        self.assertEqual(headers[b"content-encoding"], b"gzip")
+        self.assertTrue(gzip.decompress(body).startswith(b"<html>"))
+
+    def test_matching_etag_is_not_modified(self):
+        _, headers, _ = call(self.app, path="/")
+        status, _, body = call(
+            self.app, path="/", headers=[("if-none-match", headers[b"etag"].decode())]
+        )
+        self.assertEqual(status, 304)
+        self.assertEqual(body, b"")
+
+    def test_misses_fall_through(self):
+        _, headers, _ = call(self.app, path="/missing.js")
+        self.assertEqual(headers[b"content-type"], b"text/plain")
+
+
+class TestPrioritizeRoutes(unittest.TestCase):
+    def test_task_routes_move_to_the_front(self):
+        instance = FastAPI()
+        instance.get("/api/v1/musics")(lambda: None)
+        instance.get("/api/v1/tasks/{task_id}")(lambda: None)
+        prioritize_routes(instance)
+        self.assertEqual(instance.router.routes[0].path, "/api/v1/tasks/{task_id}")
+
+    def test_order_is_kept_when_an_earlier_route_overlaps(self):
+        instance = FastAPI()
+        instance.get("/api/v1/{name}/{item}")(lambda: None)
+        instance.get("/api/v1/tasks/{task_id}")(lambda: None)
+        paths = [route.path for route in instance.router.routes]
+        prioritize_routes(instance)
+        self.assertEqual([route.path for route in instance.router.routes], paths)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from app.models.schema import MaterialInfo, VideoConcatMode
+from app.services import material
+
+
+def item(name, duration=5):
+    info = MaterialInfo()
+    info.url = f"https://videos.example/{name}.mp4"
+    info.duration = duration
+    return info
+
+
+class TestDownloadVideos(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.save_dir = tmp.name
+        self.saved = []
+
+        async def save_videos(video_urls, save_dir, cancel_event=None):
+            self.saved.extend(video_urls)
+            return [material._video_path(url, save_dir) for url in video_urls]
+
+        self.search = mock.Mock(return_value=[item(name) for name in "abcdef"])
+        for patcher in (
+            mock.patch.object(material, "search_videos_pexels", self.search),
+            mock.patch.object(material, "_save_videos", save_videos),
+            mock.patch.object(
+                material, "_material_directory", return_value=self.save_dir
+            ),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def download(self, mode, remaining_items=None):
+        return material.download_videos(
+            task_id="t1",
+            search_terms=["sea"],
+            video_contact_mode=mode,
+            audio_duration=9,
+            max_clip_duration=5,
+            remaining_items=remaining_items,
+        )
+
+    def test_more_videos_come_from_the_first_search(self):
+        remaining_items = []
+        paths = self.download(VideoConcatMode.sequential, remaining_items)
+        self.assertEqual(len(paths), 2)
+        self.assertEqual(
+            [info.url for info in remaining_items], [item(n).url for n in "cdef"]
+        )
+
+        more = material.download_more_videos(
+            "t1", remaining_items, audio_duration=6, max_clip_duration=5
+        )
+        self.assertEqual(len(more), 2)
+        self.assertEqual(self.search.call_count, 1)
+        self.assertEqual(self.saved, [item(n).url for n in "abcd"])
+        self.assertEqual(len(remaining_items), 2)
+
+    def test_clips_on_disk_go_first_only_in_sequential_mode(self):
+        cached = material._video_path(item("e").url, self.save_dir)
+        open(cached, "wb").close()
+
+        self.download(VideoConcatMode.sequential)
+        self.assertEqual(self.saved[0], item("e").url)
+
+        self.saved.clear()
+        with mock.patch.object(material.random, "shuffle"):
+            self.download(VideoConcatMode.random)
+        self.assertEqual(self.saved, [item(n).url for n in "ab"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from app.models import const
+from app.services.state import MemoryState, RedisState
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+class StateBackendTests:
+    """The same update sequence, run against every backend."""
+
+    def make_state(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.state = self.make_state()
+
+    def test_update_merges_extra_fields(self):
+        self.state.update_task("t1", progress=10, script="hello")
+        self.state.update_task("t1", progress=50, terms=["a", "b"])
+        self.state.update_task("t1", state=const.TASK_STATE_COMPLETE, progress=100)
+
+        self.assertEqual(
+            self.state.get_task("t1"),
+            {
+                "state": const.TASK_STATE_COMPLETE,
+                "progress": 100,
+                "script": "hello",
+                "terms": ["a", "b"],
+            },
+        )
+
+    def test_progress_is_clamped(self):
+        self.state.update_task("t1", progress=150)
+        self.assertEqual(self.state.get_task("t1")["progress"], 100)
+
+    def test_missing_and_deleted_tasks(self):
+        self.assertIsNone(self.state.get_task("missing"))
+        self.state.update_task("t1", progress=20)
+        self.state.delete_task("t1")
+        self.assertIsNone(self.state.get_task("t1"))
+
+    def test_get_tasks(self):
+        self.state.update_task("t1", progress=20)
+        tasks = self.state.get_tasks(["t1", "missing"])
+        self.assertEqual(tasks["t1"]["progress"], 20)
+        self.assertIsNone(tasks["missing"])
+
+    def test_returned_task_is_a_copy(self):
+        self.state.update_task("t1", progress=20)
+        self.state.get_task("t1")["progress"] = 99
+        self.assertEqual(self.state.get_task("t1")["progress"], 20)
+
+
+class TestMemoryState(StateBackendTests, unittest.TestCase):
+    def make_state(self):
+        return MemoryState()
+
+    def test_recreated_task_does_not_see_old_values(self):
+        self.state.update_task("t1", progress=80, videos=["a.mp4"])
+        self.state.delete_task("t1")
+        self.state.update_task("t1", progress=10)
+        self.assertEqual(
+            self.state.get_task("t1"),
+            {"state": const.TASK_STATE_PROCESSING, "progress": 10},
+        )
+
+    def test_tasks_keep_separate_slots(self):
+        self.state.update_task("t1", progress=10)
+        self.state.update_task("t2", state=const.TASK_STATE_FAILED, progress=30)
+        self.assertEqual(self.state.get_task("t1")["progress"], 10)
+        self.assertEqual(self.state.get_task("t2")["state"], const.TASK_STATE_FAILED)
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+class TestRedisState(StateBackendTests, unittest.TestCase):
+    def make_state(self):
+        state = RedisState()
+        state._redis = fakeredis.FakeStrictRedis()
+        return state
+
+    def test_an_update_is_a_single_hset(self):
+        self.state.update_task("t1", progress=10, script="hello")
+        with mock.patch.object(self.state._redis, "execute_command") as execute:
+            self.state.update_task("t1", progress=20)
+        execute.assert_called_once()
+        self.assertEqual(execute.call_args.args[:2], ("HSET", "task:t1"))
+
+    def test_async_updates_merge_and_expire(self):
+        self.state._ttl = 60
+        self.state._async_redis = fakeredis.FakeAsyncRedis()
+
+        async def run():
+            await self.state.aupdate_task("t1", progress=10, script="hello")
+            await self.state.aupdate_task("t1", progress=30)
+            ttl = await self.state.async_redis.ttl("task:t1")
+            return await self.state.aget_task("t1"), ttl
+
+        task, ttl = asyncio.run(run())
+        self.assertEqual(
+            task,
+            {"state": const.TASK_STATE_PROCESSING, "progress": 30, "script": "hello"},
+        )
+        self.assertTrue(0 < ttl <= 60)
+
+    def test_legacy_hash_records_are_migrated_once(self):
+        task_id = "6c85c8cc-a77a-42b9-bc30-947815aa0558"
+        self.state._redis.hset(task_id, mapping={"state": "1", "progress": "40"})
+        self.state._redis.hset(task_id, "videos", str(["a.mp4"]))
+        self.state._redis.set("unrelated", "value")
+
+        self.assertEqual(self.state.migrate_legacy_tasks(), 1)
+        self.assertFalse(self.state._redis.exists(task_id))
+        self.assertTrue(self.state._redis.exists("unrelated"))
+        self.assertEqual(
+            self.state.get_task(task_id),
+            {"state": 1, "progress": 40, "videos": ["a.mp4"]},
+        )
+        self.assertEqual(self.state.migrate_legacy_tasks(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import tempfile
+import unittest
+
+from app.services import subtitle
+
+SRT = """1
+00:00:00,000 --> 00:00:01,500
+Hello
+world
+
+2
+00:00:01,500 --> 00:00:03,000
+Bye
+
+"""
+
+
+class TestParseSubtitles(unittest.TestCase):
+    def test_parses_every_cue(self):
+        self.assertEqual(
+            subtitle.file_to_subtitles("", from_text=SRT),
+            [
+                (1, "00:00:00,000 --> 00:00:01,500", "Hello\nworld"),
+                (2, "00:00:01,500 --> 00:00:03,000", "Bye"),
+            ],
+        )
+
+    def test_file_and_text_give_the_same_items(self):
+        with tempfile.NamedTemporaryFile(
+            "w", suffix=".srt", encoding="utf-8", delete=False
+        ) as f:
+            f.write(SRT)
+        self.assertEqual(
+            subtitle.file_to_subtitles(f.name),
+            subtitle.file_to_subtitles("", from_text=SRT),
+        )
+
+    def test_missing_file(self):
+        self.assertEqual(subtitle.file_to_subtitles("/no/such/file.srt"), [])
+
+
+class TestCorrect(unittest.TestCase):
+    def correct(self, cues, script):
+        srt = "".join(
+            f"{i}\n{times}\n{text}\n\n" for i, (times, text) in enumerate(cues, start=1)
+        )
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        subtitle_file = os.path.join(tmp.name, "subtitle.srt")
+        with open(subtitle_file, "w", encoding="utf-8") as f:
+            f.write(srt)
+        items = subtitle.correct(subtitle_file, script)
+        self.assertEqual(subtitle.file_to_subtitles(subtitle_file), items)
+        return items
+
+    def test_matching_cues_are_kept(self):
+        cues = [
+            ("00:00:00,000 --> 00:00:01,000", "Hello world"),
+            ("00:00:01,000 --> 00:00:02,000", "How are you"),
+        ]
+        self.assertEqual(
+            self.correct(cues, "Hello world. How are you."),
+            [(1, cues[0][0], cues[0][1]), (2, cues[1][0], cues[1][1])],
+        )
+
+    def test_lines_and_cues_are_joined_within_the_window(self):
+        cues = [
+            ("00:00:00,000 --> 00:00:01,000", "Hello world"),
+            ("00:00:01,000 --> 00:00:03,000", "How are you I am fine"),
+            ("00:00:03,000 --> 00:00:04,000", "See you"),
+            ("00:00:04,000 --> 00:00:05,000", "later"),
+        ]
+        self.assertEqual(
+            self.correct(cues, "Hello world. How are you. I am fine. See you later."),
+            [
+                (1, "00:00:00,000 --> 00:00:01,000", "Hello world"),
+                (2, "00:00:01,000 --> 00:00:03,000", "How are you I am fine"),
+                (3, "00:00:03,000 --> 00:00:05,000", "See you later"),
+            ],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
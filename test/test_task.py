@@ -0,0 +1,84 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import orjson
+
+from app.services import task as tm
+
+
+class TestTaskCache(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = tmp.name
+
+        def storage_dir(sub_dir="", create=False):
+            d = os.path.join(self.root, sub_dir)
+            os.makedirs(d, exist_ok=True)
+            return d
+
+        for patcher in (
+            mock.patch.object(tm.utils, "storage_dir", side_effect=storage_dir),
+            mock.patch.object(tm, "_cache_index", None),
+            mock.patch.object(tm, "_cache_max_entries", 10),
+            mock.patch.object(tm, "_cache_low_water", 9),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def manifest(self):
+        with open(tm._cache_manifest(), "rb") as f:
+            return [orjson.loads(line) for line in f]
+
+    def test_index_holds_only_the_location_of_the_data(self):
+        tm._cache_store("materials", "k1", materials=["a.mp4", "b.mp4"])
+        self.assertEqual(
+            tm._cache_lookup("materials", "k1"), {"materials": ["a.mp4", "b.mp4"]}
+        )
+        self.assertIsNone(tm._cache_lookup("audio", "k1"))
+
+        (record,) = self.manifest()
+        self.assertEqual(set(record), {"kind", "key", "path", "size", "atime"})
+        self.assertTrue(os.path.isfile(record["path"]))
+
+    def test_full_cache_is_trimmed_to_the_low_water_mark(self):
+        with mock.patch.object(
+            tm, "_write_cache_manifest", wraps=tm._write_cache_manifest
+        ) as rewrite:
+            for i in range(10):
+                tm._cache_store("materials", f"k{i}", materials=[f"{i}.mp4"])
+            # a hit makes k0 the most recently used entry
+            tm._cache_lookup("materials", "k0")
+            tm._cache_store("materials", "k10", materials=["10.mp4"])
+            tm._cache_store("materials", "k11", materials=["11.mp4"])
+
+        rewrite.assert_called_once()
+        self.assertIsNone(tm._cache_lookup("materials", "k1"))
+        self.assertIsNone(tm._cache_lookup("materials", "k2"))
+        self.assertIsNotNone(tm._cache_lookup("materials", "k0"))
+        self.assertEqual(len(tm._cache_index), 10)
+
+    def test_manifest_is_compacted_on_load(self):
+        tm._cache_store("materials", "k1", materials=["a.mp4"])
+        tm._cache_store("materials", "k1", materials=["b.mp4"])
+        self.assertEqual(len(self.manifest()), 2)
+
+        tm._cache_index = None
+        self.assertEqual(tm._cache_lookup("materials", "k1"), {"materials": ["b.mp4"]})
+        self.assertEqual(len(self.manifest()), 1)
+
+    def test_expired_entries_are_dropped_with_their_files(self):
+        tm._cache_store("materials", "k1", materials=["a.mp4"])
+        (record,) = self.manifest()
+
+        tm._cache_index = None
+        with mock.patch.object(tm, "_cache_max_age", -1):
+            self.assertIsNone(tm._cache_lookup("materials", "k1"))
+        self.assertFalse(os.path.exists(record["path"]))
+        self.assertEqual(self.manifest(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
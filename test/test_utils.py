@@ -0,0 +1,34 @@
+import unittest
+
+from app.utils import utils
+
+
+class TestSplitSentences(unittest.TestCase):
+    def test_terminator_runs_stay_with_their_sentence(self):
+        self.assertEqual(
+            utils.split_sentences("Wait... what?! Really."),
+            ["Wait...", "what?!", "Really."],
+        )
+
+    def test_cjk_terminators_need_no_whitespace(self):
+        self.assertEqual(utils.split_sentences("你好！！我是谁？"), ["你好！！", "我是谁？"])
+
+    def test_decimals_and_abbreviations_are_not_split(self):
+        self.assertEqual(
+            utils.split_sentences("It rose 3.5 percent in the U.S. today. Yes"),
+            ["It rose 3.5 percent in the U.S. today.", "Yes"],
+        )
+        self.assertEqual(
+            utils.split_sentences("Dr. Smith came late, e.g. at noon. Mr. Li did not."),
+            ["Dr. Smith came late, e.g. at noon.", "Mr. Li did not."],
+        )
+
+    def test_punctuation_only_pieces_are_merged(self):
+        self.assertEqual(utils.split_sentences("... Hi. !! Bye."), ["... Hi. !!", "Bye."])
+
+    def test_empty_text(self):
+        self.assertEqual(utils.split_sentences("  "), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
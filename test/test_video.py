@@ -0,0 +1,217 @@
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from PIL import Image
+
+from app.models.schema import VideoConcatMode, VideoParams
+from app.services import video
+from app.utils import utils
+
+FONT_PATH = os.path.join(utils.font_dir(), "STHeitiMedium.ttc")
+
+
+class TestEncoderParams(unittest.TestCase):
+    def test_encoder_params(self):
+        self.assertEqual(
+            video._encoder_params("libx264"),
+            ["-preset", "superfast", "-tune", "fastdecode", "-movflags", "+faststart"],
+        )
+        self.assertIn("-delay", video._encoder_params("h264_nvenc"))
+        self.assertEqual(video._encoder_params("mpeg4"), ["-movflags", "+faststart"])
+
+    def test_moviepy_args_pass_the_preset_once(self):
+        self.assertEqual(
+            video._moviepy_encoder_args("libx264"),
+            {
+                "preset": "superfast",
+                "ffmpeg_params": ["-tune", "fastdecode", "-movflags", "+faststart"],
+            },
+        )
+        args = video._moviepy_encoder_args("h264_videotoolbox")
+        self.assertEqual(args["preset"], "medium")
+        self.assertNotIn("-preset", args["ffmpeg_params"])
+
+
+class TestAssStyle(unittest.TestCase):
+    def style(self, params, line_count=1):
+        return dict(
+            item.split("=", 1)
+            for item in video._ass_style(params, "Heiti", 1920, line_count).split(",")
+        )
+
+    def test_ass_color_is_bgr(self):
+        self.assertEqual(video._ass_color("#FF8000"), "&H000080FF")
+
+    def test_filter_path_escapes_drive_colon(self):
+        self.assertEqual(video._filter_path("C:\\subs\\a.srt"), "'C\\:/subs/a.srt'")
+
+    def test_ass_style_scales_to_the_script_canvas(self):
+        params = VideoParams(video_subject="test", font_size=60, stroke_width=1.5)
+        style = self.style(params)
+        self.assertEqual(style["FontName"], "Heiti")
+        self.assertEqual(style["FontSize"], "9.0")
+        self.assertEqual(style["Alignment"], "2")
+        self.assertEqual(style["MarginV"], "14")
+        self.assertEqual(style["WrapStyle"], "2")
+
+        params.subtitle_position = "top"
+        self.assertEqual(self.style(params)["Alignment"], "8")
+
+    def test_custom_position_leaves_room_for_the_text(self):
+        params = VideoParams(
+            video_subject="test",
+            font_size=60,
+            subtitle_position="custom",
+            custom_position=70,
+        )
+        # (1920 - 2 * 60) * 0.3 video pixels below the text, scaled to 288
+        self.assertEqual(self.style(params, line_count=2)["MarginV"], "81")
+
+        params.custom_position = 100
+        # clamped to the 10 pixel margin
+        self.assertEqual(self.style(params)["MarginV"], "2")
+
+
+class TestImageSegments(unittest.TestCase):
+    def test_zoom_filter_uses_even_dimensions(self):
+        self.assertEqual(
+            video._zoom_filter(1001, 801, 4),
+            "zoompan=z='1+0.12*on/120'"
+            ":x='iw/2-(iw/zoom/2)':y='ih/2-(ih/zoom/2)'"
+            ":d=120:s=1000x800:fps=30",
+        )
+
+    def test_images_are_zoomed_while_preparing_the_segment(self):
+        commands = []
+
+        def fake_run(cmd, **kwargs):
+            commands.append(cmd)
+            return SimpleNamespace(returncode=0, stderr="")
+
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.object(
+            video, "_ffmpeg_exe", return_value="ffmpeg"
+        ), mock.patch.object(video.subprocess, "run", side_effect=fake_run):
+            image_path = os.path.join(tmp, "a.png")
+            Image.new("RGB", (640, 480)).save(image_path)
+            ok = video._prep_segment(
+                image_path, 0, 3, 1080, 1920, os.path.join(tmp, "0.mp4"), "libx264", 2, 4
+            )
+
+        self.assertTrue(ok)
+        cmd = commands[0]
+        self.assertEqual(cmd[cmd.index("-loop") + 1], "1")
+        self.assertEqual(cmd[cmd.index("-t") + 1], "3.000")
+        self.assertNotIn("-ss", cmd)
+        self.assertTrue(
+            cmd[cmd.index("-vf") + 1].startswith(video._zoom_filter(640, 480, 4) + ",scale=")
+        )
+
+
+class TestFfmpegCombine(unittest.TestCase):
+    def run_combine(self, audio_duration):
+        commands = []
+        concat_lists = []
+
+        def fake_run(cmd, **kwargs):
+            commands.append(cmd)
+            if "concat" in cmd:
+                with open(cmd[cmd.index("-i") + 1], encoding="utf-8") as f:
+                    concat_lists.append(f.read())
+            return SimpleNamespace(returncode=0, stderr="")
+
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.object(
+            video, "_probe_video", return_value=(6.0, "h264")
+        ), mock.patch.object(video, "_ffmpeg_exe", return_value="ffmpeg"), mock.patch.object(
+            video.subprocess, "run", side_effect=fake_run
+        ):
+            ok = video._ffmpeg_combine(
+                combined_video_path=os.path.join(tmp, "combined.mp4"),
+                video_paths=["a.mp4", "b.mp4"],
+                audio_duration=audio_duration,
+                video_width=1080,
+                video_height=1920,
+                video_concat_mode=VideoConcatMode.sequential,
+                max_clip_duration=5,
+                threads=2,
+                encoder="libx264",
+                max_workers=1,
+            )
+            self.assertFalse(os.path.exists(os.path.join(tmp, "combined.mp4.segments")))
+        self.assertTrue(ok)
+        return commands, concat_lists
+
+    def test_segments_are_cut_letterboxed_and_concatenated(self):
+        commands, concat_lists = self.run_combine(audio_duration=12)
+
+        prep_commands, concat_command = commands[:-1], commands[-1]
+        # a 0-5, b 0-5 and a 0-2 to cover the last two seconds
+        self.assertEqual(len(prep_commands), 3)
+        first = prep_commands[0]
+        self.assertEqual(first[first.index("-ss") + 1 : first.index("-to") + 2], ["0.000", "-to", "5.000"])
+        self.assertEqual(first[first.index("-i") + 1], "a.mp4")
+        self.assertEqual(
+            first[first.index("-vf") + 1],
+            "scale=1080:1920:force_original_aspect_ratio=decrease,"
+            "pad=1080:1920:(ow-iw)/2:(oh-ih)/2:color=black,setsar=1,fps=30",
+        )
+        self.assertEqual(first[first.index("-threads") + 1], "2")
+        self.assertEqual(prep_commands[2][prep_commands[2].index("-to") + 1], "2.000")
+
+        self.assertEqual(concat_command[concat_command.index("-c") + 1], "copy")
+        self.assertEqual(
+            concat_lists[0],
+            "ffconcat version 1.0\nfile '0.mp4'\nfile '1.mp4'\nfile '2.mp4'\n",
+        )
+
+    def test_repeated_segments_are_prepared_once(self):
+        commands, concat_lists = self.run_combine(audio_duration=20)
+        # a, b, a, b: two segments, each listed twice
+        self.assertEqual(len(commands) - 1, 2)
+        self.assertEqual(
+            concat_lists[0],
+            "ffconcat version 1.0\nfile '0.mp4'\nfile '1.mp4'\nfile '0.mp4'\nfile '1.mp4'\n",
+        )
+
+
+class TestLoadSubtitles(unittest.TestCase):
+    def test_parses_times_and_multiline_text(self):
+        with tempfile.NamedTemporaryFile(
+            "w", suffix=".srt", encoding="utf-8", delete=False
+        ) as f:
+            f.write(
+                "1\r\n00:00:00,000 --> 00:00:01,500\r\nHello\r\nworld\r\n\r\n"
+                "2\r\n00:01:01,500 --> 00:01:03,250\r\nBye\r\n"
+            )
+        self.assertEqual(
+            video._load_subtitles(f.name),
+            [((0.0, 1.5), "Hello\nworld"), ((61.5, 63.25), "Bye")],
+        )
+
+
+class TestWrapText(unittest.TestCase):
+    def test_short_text_is_unchanged(self):
+        text, _ = video.wrap_text("Hi", max_width=1000, font=FONT_PATH, fontsize=60)
+        self.assertEqual(text, "Hi")
+
+    def test_lines_fit_the_width(self):
+        font = video._get_font(FONT_PATH, 60)
+        for phrase in (
+            "a fairly long english subtitle line that has to wrap several times",
+            "这是一段很长的中文字幕需要按照字符换行才能放进画面里面",
+        ):
+            wrapped, height = video.wrap_text(
+                phrase, max_width=400, font=FONT_PATH, fontsize=60
+            )
+            lines = wrapped.split("\n")
+            self.assertGreater(len(lines), 1)
+            for line in lines:
+                # kerning may shift the measured width by a pixel
+                self.assertLessEqual(font.getlength(line), 401)
+            self.assertEqual(wrapped.replace("\n", "").replace(" ", ""), phrase.replace(" ", ""))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,36 @@
+import os
+import tempfile
+import unittest
+
+from edge_tts import SubMaker
+
+from app.services import voice
+
+
+class TestCreateSubtitle(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.subtitle_file = os.path.join(tmp.name, "subtitle.srt")
+
+    def test_matched_lines_are_written(self):
+        sub_maker = SubMaker()
+        sub_maker.offset = [(0, 10000000), (10000000, 25000000)]
+        sub_maker.subs = ["Hello world", "Bye"]
+
+        srt = voice.create_subtitle(sub_maker, "Hello world. Bye.", self.subtitle_file)
+        self.assertEqual(
+            srt,
+            "1\n00:00:00,000 --> 00:00:01,000\nHello world\n\n"
+            "2\n00:00:01,000 --> 00:00:02,500\nBye\n\n",
+        )
+        with open(self.subtitle_file, encoding="utf-8") as f:
+            self.assertEqual(f.read(), srt)
+
+    def test_no_cues_is_a_failure(self):
+        self.assertEqual(voice.create_subtitle(SubMaker(), "", self.subtitle_file), "")
+        self.assertFalse(os.path.exists(self.subtitle_file))
+
+
+if __name__ == "__main__":
+    unittest.main()